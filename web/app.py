@@ -2,9 +2,16 @@
 import os
 import uuid
 import datetime
-import random
 import json
+import hmac
+import atexit
+import multiprocessing
+import threading
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+import click
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -13,14 +20,18 @@ load_dotenv()
 # Third-Party Imports
 from flask import (
     Flask,
+    Response,
     jsonify,
+    stream_with_context,
     request,
     render_template,
     redirect,
     url_for,
 )
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_, and_
+from sqlalchemy import select, update, union_all, event, func, tuple_, text, or_, literal
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.orm import aliased
 from flask_login import (
     UserMixin,
     login_user,
@@ -33,14 +44,59 @@ from flask_bcrypt import Bcrypt # For password hashing
 from flask_migrate import Migrate
 
 from rsa import RSA
+from pubsub import create_hub
+from caches import PublicKeyCache, create_ttl_cache
+from kdc import encrypt_session_key, encrypt_session_keys
+from hashing import PasswordHasher, HasherBusy
+from database import database_uri, engine_options
+from ingest import IngestQueue, IngestQueueFull
+from streaming import stream_json_list
+from metrics import Metrics
+from archive import MessageArchive
+import transfer
 
 # Initialize the Flask app
 app = Flask(__name__, template_folder='templates', static_folder='static')
 rsa = RSA()
 # Configurations
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite3'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
+app.config['MESSAGES_PAGE_SIZE'] = int(os.getenv("MESSAGES_PAGE_SIZE", 100))
+app.config['MESSAGES_MAX_PAGE_SIZE'] = int(os.getenv("MESSAGES_MAX_PAGE_SIZE", 500))
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv("STREAM_BATCH_SIZE", 1000))  # Rows fetched at a time when streaming
+app.config['USERS_PAGE_SIZE'] = int(os.getenv("USERS_PAGE_SIZE", 50))
+app.config['USERS_MAX_PAGE_SIZE'] = int(os.getenv("USERS_MAX_PAGE_SIZE", 200))
+app.config['EVENTS_BROKER_URL'] = os.getenv("EVENTS_BROKER_URL", "memory://")
+app.config['EVENTS_HEARTBEAT_SECONDS'] = int(os.getenv("EVENTS_HEARTBEAT_SECONDS", 15))
+app.config['PUBLIC_KEY_CACHE_SIZE'] = int(os.getenv("PUBLIC_KEY_CACHE_SIZE", 1024))
+app.config['KDC_WORKERS'] = int(os.getenv("KDC_WORKERS", os.cpu_count() or 1))
+app.config['KDC_POOL_MIN_BATCH'] = int(os.getenv("KDC_POOL_MIN_BATCH", 16))
+app.config['KDC_MAX_BATCH'] = int(os.getenv("KDC_MAX_BATCH", 500))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 32))
+app.config['USER_CACHE_URL'] = os.getenv("USER_CACHE_URL", "memory://")
+app.config['USER_CACHE_TTL'] = int(os.getenv("USER_CACHE_TTL", 30))
+app.config['INGEST_MODE'] = os.getenv("INGEST_MODE", "sync")  # "sync" or "write_behind"
+app.config['INGEST_JOURNAL_PATH'] = os.getenv("INGEST_JOURNAL_PATH", os.path.join(app.instance_path, "ingest.journal"))
+app.config['INGEST_QUEUE_SIZE'] = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+app.config['INGEST_BATCH_SIZE'] = int(os.getenv("INGEST_BATCH_SIZE", 500))
+app.config['INGEST_MAX_RETRY_SECONDS'] = float(os.getenv("INGEST_MAX_RETRY_SECONDS", 30))
+app.config['ARCHIVE_DIR'] = os.getenv("ARCHIVE_DIR", os.path.join(app.instance_path, "archive"))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv("ARCHIVE_AFTER_DAYS", 180))
+app.config['ARCHIVE_SEGMENT_SIZE'] = int(os.getenv("ARCHIVE_SEGMENT_SIZE", 5000))
+app.config['METRICS_TOKEN'] = os.getenv("METRICS_TOKEN")  # Bearer token required on /metrics, if set
+app.config['SLOW_REQUEST_MS'] = int(os.getenv("SLOW_REQUEST_MS", 0))  # Profile requests slower than this, 0 = off
+app.config['PROFILE_DIR'] = os.getenv("PROFILE_DIR", os.path.join(app.instance_path, "profiles"))
+
+# Per-endpoint latency, SQL and response size metrics, served on /metrics
+metrics = Metrics(
+    slow_request_seconds=app.config['SLOW_REQUEST_MS'] / 1000 or None,
+    profile_dir=app.config['PROFILE_DIR']
+)
+metrics.init_app(app)
 
 # Initialize the database
 db = SQLAlchemy(app)
@@ -51,16 +107,89 @@ migrate = Migrate(app, db)
 # Initialize the Bcrypt
 bcrypt = Bcrypt(app)
 
+# Password hashing runs on its own bounded pool so logins cannot starve other requests
+password_hasher = PasswordHasher(
+    bcrypt,
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_MAX_PENDING']
+)
+
+# Initialize the pub/sub hub used to push new messages to connected clients
+hub = create_hub(app.config['EVENTS_BROKER_URL'])
+
+# Parsed public keys of the users we encrypt session keys for
+public_keys = PublicKeyCache(rsa.parse_public_key, max_size=app.config['PUBLIC_KEY_CACHE_SIZE'])
+
+# Process pool for batch RSA encryptions, started on first use
+kdc_executor = None
+
+def get_kdc_executor():
+    global kdc_executor
+    if kdc_executor is None:
+        # spawn, so workers do not inherit the server's threads and DB connections
+        kdc_executor = ProcessPoolExecutor(
+            max_workers=app.config['KDC_WORKERS'],
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return kdc_executor
+
+# Snapshots of logged-in users, so authenticated requests skip the users table.
+# Entries expire after USER_CACHE_TTL seconds, which bounds how long a ban can go unnoticed.
+user_cache = create_ttl_cache(app.config['USER_CACHE_URL'], app.config['USER_CACHE_TTL'], prefix="keyforge:user:")
+
+# Compressed segments of messages moved out of the message table by `flask keyforge archive`
+message_archive = MessageArchive(app.config['ARCHIVE_DIR'])
+
 # Initialize the LoginManager
 login_manager = LoginManager()
 login_manager.init_app(app)  # Associate it with the app
 login_manager.login_view = 'login'  # Redirect unauthorized users to the login page
 
 
+class UserSnapshot(UserMixin):
+    """
+    Detached, read-only copy of the `User` fields needed on every request.
+    This is what `current_user` is for authenticated requests; load the `User`
+    row explicitly to change anything.
+    """
+    FIELDS = ('id', 'user_id', 'username', 'public_key', 'is_admin', 'is_deleted', 'is_banned')
+
+    def __init__(self, **fields):
+        for field in self.FIELDS:
+            setattr(self, field, fields.get(field))
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{field: getattr(user, field) for field in cls.FIELDS})
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @property
+    def is_active(self) -> bool:
+        return not self.is_banned and not self.is_deleted
+
+    def get_id(self) -> str:
+        return self.user_id
+
+
 # User loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.filter_by(user_id=user_id).first()
+    """
+    Load the user for a session from the user cache, falling back to the database.
+    Banned or deleted users get None, which logs them out.
+    """
+    data = user_cache.get(user_id)
+    if data is None:
+        user = User.query.filter_by(user_id=user_id).first()
+        if user is None:
+            return None
+        data = UserSnapshot.from_user(user).to_dict()
+        user_cache.set(user_id, data)
+
+    snapshot = UserSnapshot(**data)
+    return snapshot if snapshot.is_active else None
 
 
 # User model
@@ -83,13 +212,67 @@ class User(db.Model, UserMixin):
 
     def __str__(self) -> str:
         return f"{self.id} : {self.username}"
-    
+
+    @property
+    def is_active(self) -> bool:
+        return not self.is_banned and not self.is_deleted
+
     def get_id(self) -> str:
         return self.user_id 
 
+
+# Case-insensitive prefix search and paging in the user directory
+db.Index('ix_users_username_lower', func.lower(User.username), User.username)
+
+# Drop cached snapshots whenever a user row changes, e.g. an admin bans or deletes it
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    user_cache.delete(target.user_id)
+
+# Counter model: named version numbers, bumped whenever the data they cover changes
+class Counter(db.Model):
+    __tablename__ = 'counters'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+def bump_counter(connection, name):
+    """Increment counter `name` on `connection`, i.e. inside the current flush."""
+    counters = Counter.__table__
+    result = connection.execute(
+        counters.update().where(counters.c.name == name).values(value=counters.c.value + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(counters.insert().values(name=name, value=1))
+
+def get_counter(name) -> int:
+    return db.session.execute(select(Counter.value).where(Counter.name == name)).scalar() or 0
+
+# The user directory only shows these columns (and hides deleted or banned users)
+DIRECTORY_FIELDS = ('username', 'is_deleted', 'is_banned')
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_delete')
+def bump_directory_version(mapper, connection, target):
+    bump_counter(connection, 'users')
+
+@event.listens_for(User, 'after_update')
+def bump_directory_version_on_update(mapper, connection, target):
+    # Logins update last_login on every user, which must not invalidate the directory
+    state = db.inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in DIRECTORY_FIELDS):
+        bump_counter(connection, 'users')
+
 # EncryptedKeys model
 class EncryptedKeys(db.Model):
     __tablename__ = 'encrypted_keys'
+    __table_args__ = (
+        # One row per user pair, always stored with user1_id < user2_id
+        db.UniqueConstraint('user1_id', 'user2_id', name='uq_encrypted_keys_user_pair'),
+        # The unique constraint covers lookups by user1_id, this covers user2_id
+        db.Index('ix_encrypted_keys_user2_id', 'user2_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user1_id = db.Column(db.String(150), nullable=False)
@@ -102,9 +285,23 @@ class EncryptedKeys(db.Model):
     def __str__(self) -> str:
         return f"{self.id} : {self.user1_id} - {self.user2_id}"
 
+def conversation_key(user_a_id, user_b_id) -> str:
+    """
+    Canonical id of the conversation between two users: the sorted pair of
+    user ids, so both directions of a chat share the same key.
+    """
+    lo, hi = sorted((str(user_a_id), str(user_b_id)))
+    return f"{lo}:{hi}"
+
 # Message model
 class Message(db.Model):
+    __table_args__ = (
+        # History queries are a range scan over one conversation ordered by id
+        db.Index('ix_message_conversation_id_id', 'conversation_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.String(301), nullable=False)
     sender_id = db.Column(db.String(150), db.ForeignKey("users.user_id"))
     receiver_id = db.Column(db.String(150), db.ForeignKey("users.user_id"))
     encrypted_message = db.Column(db.Text, nullable=False)
@@ -113,6 +310,221 @@ class Message(db.Model):
     def __str__(self) -> str:
         return f"{self.id} : {self.sender_id} - {self.receiver_id} : {self.encrypted_message}"
 
+# Conversation model: one summary row per user pair, kept up to date as messages are stored
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+    __table_args__ = (
+        # The inbox query looks a user up on either side of the pair
+        db.Index('ix_conversations_user1_id', 'user1_id'),
+        db.Index('ix_conversations_user2_id', 'user2_id'),
+    )
+
+    # Same key as Message.conversation_id; user1_id < user2_id like EncryptedKeys
+    id = db.Column(db.String(301), primary_key=True)
+    user1_id = db.Column(db.String(150), db.ForeignKey("users.user_id"), nullable=False)
+    user2_id = db.Column(db.String(150), db.ForeignKey("users.user_id"), nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    last_message_at = db.Column(db.DateTime, nullable=False)
+    # Messages each side has not read yet
+    unread_1 = db.Column(db.Integer, nullable=False, default=0)
+    unread_2 = db.Column(db.Integer, nullable=False, default=0)
+    # Messages with ids up to this one were moved to archive segments
+    archived_through = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __str__(self) -> str:
+        return f"{self.id} : {self.last_message_id} ({self.unread_1}/{self.unread_2} unread)"
+
+
+# ArchiveSegment model: one compressed file of archived messages (see MessageArchive)
+class ArchiveSegment(db.Model):
+    __tablename__ = 'archive_segments'
+    __table_args__ = (
+        db.Index('ix_archive_segments_conversation_id_last_message_id', 'conversation_id', 'last_message_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.String(301), nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    path = db.Column(db.String(500), nullable=False)  # Relative to ARCHIVE_DIR
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now)
+
+    def __str__(self) -> str:
+        return f"{self.conversation_id} : {self.first_message_id}-{self.last_message_id}"
+
+
+def dialect_insert(model):
+    """
+    Return an INSERT construct for `model` that supports `on_conflict_do_update`
+    on the configured database, so upserts run as a single statement.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise RuntimeError(f"Unsupported database dialect for upserts: {dialect}")
+    return insert(model)
+
+
+def encrypted_keys_row(user_a_id, user_b_id, encrypted_key_a, encrypted_key_b):
+    """
+    Build an `EncryptedKeys` row for a user pair in canonical order:
+    the lower user id is always user1, and the key halves follow their owners.
+    """
+    if user_a_id < user_b_id:
+        return dict(user1_id=user_a_id, user2_id=user_b_id, encrypted_key_1=encrypted_key_a, encrypted_key_2=encrypted_key_b)
+    return dict(user1_id=user_b_id, user2_id=user_a_id, encrypted_key_1=encrypted_key_b, encrypted_key_2=encrypted_key_a)
+
+
+def upsert_encrypted_keys(rows, batch_size=100):
+    """
+    Insert or replace `EncryptedKeys` rows with multi-row INSERT ... ON CONFLICT
+    statements of up to `batch_size` rows. The caller commits.
+    """
+    now = datetime.datetime.now()
+    for i in range(0, len(rows), batch_size):
+        stmt = dialect_insert(EncryptedKeys).values([
+            dict(created_at=now, last_updated=now, **row) for row in rows[i:i + batch_size]
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user1_id', 'user2_id'],
+            set_={
+                'encrypted_key_1': stmt.excluded.encrypted_key_1,
+                'encrypted_key_2': stmt.excluded.encrypted_key_2,
+                'last_updated': stmt.excluded.last_updated,
+            }
+        )
+        db.session.execute(stmt)
+
+
+def rotate_encrypted_keys(after_id=0, user_ids=None, before=None, batch_size=1000, executor=None, chunksize=8):
+    """
+    Replace the session key of `EncryptedKeys` rows with a new one, encrypted
+    for both users with their current public keys. Rows are processed in id
+    order, starting after `after_id`, `batch_size` at a time: the RSA
+    encryptions of a batch are spread over `executor`, then the batch is
+    written with one executemany UPDATE and committed.
+    `user_ids` limits the rotation to pairs involving one of these users,
+    `before` to rows last updated before then. Pairs where a user has no
+    public key (anymore) are left unchanged.
+    Yields:
+        tuple: (last id of the batch, rows rotated, rows skipped) after every batch.
+    """
+    user1, user2 = aliased(User), aliased(User)
+    query = (
+        select(EncryptedKeys.id, EncryptedKeys.user1_id, EncryptedKeys.user2_id,
+               user1.public_key.label('public_key_1'), user2.public_key.label('public_key_2'))
+        .outerjoin(user1, user1.user_id == EncryptedKeys.user1_id)
+        .outerjoin(user2, user2.user_id == EncryptedKeys.user2_id)
+        .order_by(EncryptedKeys.id.asc())
+        .limit(batch_size)
+    )
+    if user_ids:
+        query = query.where(or_(EncryptedKeys.user1_id.in_(user_ids), EncryptedKeys.user2_id.in_(user_ids)))
+    if before is not None:
+        query = query.where(EncryptedKeys.last_updated < before)
+
+    while True:
+        rows = db.session.execute(query.where(EncryptedKeys.id > after_id)).all()
+        if not rows:
+            return
+        after_id = rows[-1].id
+
+        ready = [row for row in rows if row.public_key_1 and row.public_key_2]
+        pairs = [
+            (public_keys.get(row.user1_id, row.public_key_1), public_keys.get(row.user2_id, row.public_key_2))
+            for row in ready
+        ]
+        with metrics.timed('rsa_encrypt_session_keys_pool' if executor else 'rsa_encrypt_session_keys'):
+            encrypted = encrypt_session_keys(pairs, executor, chunksize)
+
+        if ready:
+            now = datetime.datetime.now()
+            db.session.execute(update(EncryptedKeys), [
+                dict(id=row.id, encrypted_key_1=encrypted_key_1, encrypted_key_2=encrypted_key_2, last_updated=now)
+                for row, (encrypted_key_1, encrypted_key_2) in zip(ready, encrypted)
+            ])
+        db.session.commit()
+        yield after_id, len(ready), len(rows) - len(ready)
+
+def claim_conversations(messages):
+    """
+    Upsert the `Conversation` rows of `messages` before the messages are
+    inserted, adding to the receivers' unread counters. Must run in the
+    transaction that inserts the messages, which the caller commits.
+    The upsert locks each row until that commit, so the messages of one
+    conversation get their ids, and commit, in the order the conversation
+    was claimed: a concurrent sender waits here for the earlier transaction
+    to finish, and then draws higher ids. Without this, two senders could
+    commit out of id order, and a client polling with `since` in between
+    would move its cursor past the message that commits last.
+    Rows are claimed in key order, so concurrent batches cannot deadlock.
+    """
+    summaries = {}
+    for message in messages:
+        lo, hi = sorted((message.sender_id, message.receiver_id))
+        row = summaries.setdefault(message.conversation_id, dict(
+            id=message.conversation_id, user1_id=lo, user2_id=hi, unread_1=0, unread_2=0,
+            # Placeholders for new rows, set by update_conversations once the ids exist
+            last_message_id=0, last_message_at=message.timestamp
+        ))
+        if message.receiver_id == lo:
+            row['unread_1'] += 1
+        else:
+            row['unread_2'] += 1
+
+    for conversation_id in sorted(summaries):
+        stmt = dialect_insert(Conversation).values(**summaries[conversation_id])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={
+                'unread_1': Conversation.unread_1 + stmt.excluded.unread_1,
+                'unread_2': Conversation.unread_2 + stmt.excluded.unread_2,
+            }
+        )
+        db.session.execute(stmt)
+
+
+def update_conversations(messages):
+    """
+    Point the `Conversation` rows of freshly flushed `messages`, claimed with
+    `claim_conversations` in the same transaction, at their newest message.
+    """
+    newest = {}
+    for message in messages:
+        if message.id > newest.get(message.conversation_id, (0, None))[0]:
+            newest[message.conversation_id] = (message.id, message.timestamp)
+
+    for conversation_id, (message_id, timestamp) in sorted(newest.items()):
+        Conversation.query.filter_by(id=conversation_id).update(
+            {'last_message_id': message_id, 'last_message_at': timestamp},
+            synchronize_session=False
+        )
+
+
+def conditional_response(response, etag):
+    """
+    Tag `response` with `etag` and let the browser keep it, as long as it
+    checks with us (If-None-Match) before reusing it.
+    """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.errorhandler(HasherBusy)
+def password_busy(error):
+    """
+    Too many logins/registrations are already waiting on bcrypt.
+    Answer right away and ask the client to retry instead of queueing more work.
+    """
+    response = jsonify({'error': 'Server is busy, please try again'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 
 @app.route('/')
 def index():
@@ -147,16 +559,18 @@ def store_public_key():
     """
     Stores the public key for the current user.
     This function retrieves a public key from the JSON payload of the incoming
-    HTTP request, converts it to a JSON string, and assigns it to the `public_key`
-    attribute of the current user. The change is then committed to the database.
+    HTTP request, converts it to a JSON string, and stores it in the current user's
+    `public_key` column. Cached copies of the user and of the old key are dropped.
     Returns:
         Response: A JSON response with a success message and HTTP status code 200.
     """
 
     data = request.json
     public_key = json.dumps(data.get('public_key'))  # Save as stringified JSON
-    current_user.public_key = public_key
+    User.query.filter_by(user_id=current_user.user_id).update({'public_key': public_key})
     db.session.commit()
+    public_keys.invalidate(current_user.user_id)
+    user_cache.delete(current_user.user_id)
     return jsonify({'message': 'Public key stored successfully.'}), 200
 
 
@@ -167,19 +581,18 @@ def request_key():
     Handles a request to generate and share an encrypted key between two users.
     This function performs the following steps:
     1. Validates the input JSON to ensure `user2_id` is provided.
-    2. Retrieves the current user (`user1`) and the requested user (`user2`) from the database.
+    2. Retrieves the current user (`user1`) and the requested user (`user2`) in one query.
     3. Ensures both users exist and have public keys.
     4. Prevents a user from requesting a key from themselves.
     5. Generates a random Caesar cipher key and encrypts it using both users' public keys.
-    6. Updates or creates an entry in the `EncryptedKeys` table to store the encrypted keys.
+    6. Upserts the pair's row in the `EncryptedKeys` table with a single
+       INSERT ... ON CONFLICT statement. Rows are keyed on the sorted user pair
+       (user1_id < user2_id), so concurrent requests cannot create duplicates.
     7. Returns the encrypted key for `user1`.
     Returns:
         tuple: A JSON response and an HTTP status code.
             - On success: A dictionary containing the encrypted key for `user1` and a 200 status code.
             - On failure: An error message and the corresponding HTTP status code.
-    Raises:
-        KeyError: If `user2_id` is not provided in the request JSON.
-        ValueError: If either user does not exist or lacks a public key.
     """
 
     data = request.json
@@ -190,67 +603,168 @@ def request_key():
     user1_id = current_user.user_id # user that is requesting
     user2_id = data.get('user2_id') # user that is being requested
 
-    user1 = User.query.filter_by(user_id=user1_id).first()
-    user2 = User.query.filter_by(user_id=user2_id).first()
+    if user1_id == user2_id:
+        return jsonify({'error': 'You cannot request a key from yourself'}), 400
+
+    users = {u.user_id: u for u in User.query.filter(User.user_id.in_([user1_id, user2_id]))}
+    user1 = users.get(user1_id)
+    user2 = users.get(user2_id)
 
     # Check if both users exist and have public keys
     if not user1 or not user2:
-        return None, "Users not found!"
+        return jsonify({'error': 'Users not found'}), 404
     if not user1.public_key:
         return jsonify({'error': 'User1 public key not found'}), 400
     if not user2.public_key:
         return jsonify({'error': 'User2 public key not found'}), 400
-    if user1_id == user2_id:
-        return jsonify({'error': 'You cannot request a key from yourself'}), 400
-    
-    # Generate a random Caesar cipher key
-    # The key is a random integer between 1 and 26
-    cesar_key = random.randint(1, 26)
-    cesar_key_str = str(cesar_key)
-
-    # Encrypt the key using both users' public keys
-    # The public key is a JSON string like '{"e": "...", "n": "..."}'
-    encrypted_key_1 = rsa.encrypt(cesar_key_str, user1.public_key)
-    encrypted_key_2 = rsa.encrypt(cesar_key_str, user2.public_key)
-
-    if EncryptedKeys.query.filter_by(user1_id=user1_id, user2_id=user2_id).first() or EncryptedKeys.query.filter_by(user1_id=user2_id, user2_id=user1_id).first():
-        if EncryptedKeys.query.filter_by(user1_id=user1_id, user2_id=user2_id).first():
-            key_entry = EncryptedKeys.query.filter_by(user1_id=user1_id, user2_id=user2_id).first()
-            key_entry.user1_id = user1_id
-            key_entry.user2_id = user2_id
-            key_entry.encrypted_key_1 = encrypted_key_1
-            key_entry.encrypted_key_2 = encrypted_key_2
-            key_entry.last_updated = datetime.datetime.now()
-        elif EncryptedKeys.query.filter_by(user1_id=user2_id, user2_id=user1_id).first():
-            key_entry = EncryptedKeys.query.filter_by(user1_id=user2_id, user2_id=user1_id).first()
-            key_entry.user1_id = user2_id
-            key_entry.user2_id = user1_id
-            key_entry.encrypted_key_1 = encrypted_key_2
-            key_entry.encrypted_key_2 = encrypted_key_1
-            key_entry.last_updated = datetime.datetime.now()
-        db.session.commit()
-    else:
-        key_entry = EncryptedKeys(
-            user1_id=user1_id,
-            user2_id=user2_id,
-            encrypted_key_1=encrypted_key_1,
-            encrypted_key_2=encrypted_key_2,
+
+    # Generate a random Caesar cipher key (1-26) and encrypt it using both users' public keys.
+    # Parsed keys are cached per user, and packed ciphertexts are tagged "rsa2:"
+    # so clients can tell them from the legacy format
+    with metrics.timed('rsa_encrypt_session_key'):
+        encrypted_key_1, encrypted_key_2 = encrypt_session_key(
+            public_keys.get(user1_id, user1.public_key),
+            public_keys.get(user2_id, user2.public_key)
         )
-        db.session.add(key_entry)
-        db.session.commit()
+
+    # Store the pair in canonical order, the lower user id is always user1
+    upsert_encrypted_keys([encrypted_keys_row(user1_id, user2_id, encrypted_key_1, encrypted_key_2)])
+    db.session.commit()
 
     response = {
         'user1_encrypted_key': encrypted_key_1,
-        # 'cesar_plain': cesar_key_str   # delete this. added for testing
     }
 
     return response, 200
 
+
+@app.route('/request_keys', methods=['POST'])
+@login_required
+def request_keys():
+    """
+    Batch version of `request_key`: establishes session keys between the current
+    user and every user in `user2_ids` in a single request.
+    All users are loaded with one IN query, the RSA encryptions run in a process
+    pool for large batches (KDC_POOL_MIN_BATCH), and every `EncryptedKeys` row is
+    upserted in one transaction.
+    Returns:
+        tuple: A JSON response and an HTTP status code.
+            - On success: {"keys": {user2_id: encrypted key for the current user},
+                           "errors": {user2_id: reason}} and a 200 status code.
+              Peers that are missing or have no public key are reported in
+              `errors` and do not fail the rest of the batch.
+            - On failure: An error message and the corresponding HTTP status code.
+    """
+
+    data = request.json
+    user2_ids = data.get('user2_ids')
+
+    if not isinstance(user2_ids, list) or not user2_ids:
+        return jsonify({'error': 'user2_ids must be a non-empty list'}), 400
+    if len(user2_ids) > app.config['KDC_MAX_BATCH']:
+        return jsonify({'error': f"At most {app.config['KDC_MAX_BATCH']} users per request"}), 400
+
+    user1_id = current_user.user_id
+    user2_ids = list(dict.fromkeys(str(user_id) for user_id in user2_ids))
+
+    users = {u.user_id: u for u in User.query.filter(User.user_id.in_(user2_ids + [user1_id]))}
+    user1 = users.get(user1_id)
+    if not user1 or not user1.public_key:
+        return jsonify({'error': 'User1 public key not found'}), 400
+
+    peers = []
+    errors = {}
+    for user2_id in user2_ids:
+        user2 = users.get(user2_id)
+        if user2_id == user1_id:
+            errors[user2_id] = 'You cannot request a key from yourself'
+        elif not user2:
+            errors[user2_id] = 'User not found'
+        elif not user2.public_key:
+            errors[user2_id] = 'User2 public key not found'
+        else:
+            peers.append(user2)
+
+    user1_key = public_keys.get(user1_id, user1.public_key)
+    pairs = [(user1_key, public_keys.get(peer.user_id, peer.public_key)) for peer in peers]
+    executor = get_kdc_executor() if len(pairs) >= app.config['KDC_POOL_MIN_BATCH'] else None
+    with metrics.timed('rsa_encrypt_session_keys_pool' if executor else 'rsa_encrypt_session_keys'):
+        encrypted = encrypt_session_keys(pairs, executor)
+
+    upsert_encrypted_keys([
+        encrypted_keys_row(user1_id, peer.user_id, encrypted_key_1, encrypted_key_2)
+        for peer, (encrypted_key_1, encrypted_key_2) in zip(peers, encrypted)
+    ])
+    db.session.commit()
+
+    return jsonify({
+        'keys': {peer.user_id: encrypted_key_1 for peer, (encrypted_key_1, _) in zip(peers, encrypted)},
+        'errors': errors
+    }), 200
+
 # API route to get all users
 @app.route('/api/users')
+@login_required
 def get_users():
-    users = User.query.filter(User.user_id != current_user.user_id).all()
-    return jsonify({'users': [{'username': u.username, 'user_id': u.user_id} for u in users]}), 200
+    """
+    Returns one page of the user directory, ordered by username, without the
+    current user and without deleted or banned accounts.
+    Query parameters:
+        q (str): Only return usernames starting with this prefix (case-insensitive).
+        after (str): Username of the last user on the previous page (`next` of the last response).
+        limit (int): Maximum number of users to return (capped by USERS_MAX_PAGE_SIZE).
+    Returns:
+        Response: A JSON object with `users` ({username, user_id}) and `next`,
+                  the cursor of the next page or null on the last page.
+                  Responses carry an ETag derived from the directory version, which
+                  changes whenever a user is added, renamed, deleted or banned.
+                  A matching `If-None-Match` is answered with 304 and no query
+                  against the users table.
+    """
+
+    etag = f"users-{get_counter('users')}-{current_user.user_id}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        prefix = request.args.get('q', '').strip()
+        after = request.args.get('after')
+        limit = request.args.get('limit', app.config['USERS_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, app.config['USERS_MAX_PAGE_SIZE']))
+
+        username_lower = func.lower(User.username)
+        query = select(User.username, User.user_id).where(
+            User.user_id != current_user.user_id,
+            User.is_deleted.isnot(True),
+            User.is_banned.isnot(True)
+        )
+        # Case folding is left to the database's lower(), which built the index:
+        # SQLite's only folds ASCII, so Python's str.lower() can disagree with it
+        if prefix:
+            prefix = db.session.execute(select(func.lower(prefix))).scalar()
+            # A range on the lower(username) index: everything from the prefix
+            # up to the prefix with its last character incremented
+            query = query.where(username_lower >= prefix)
+            if ord(prefix[-1]) < 0x10FFFF:  # Nothing sorts after the last code point
+                query = query.where(username_lower < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        if after:
+            after_lower = func.lower(literal(after))
+            query = query.where(
+                # Redundant, but lets SQLite seek the index instead of scanning up to the cursor
+                username_lower >= after_lower,
+                tuple_(username_lower, User.username) > tuple_(after_lower, literal(after))
+            )
+
+        # Fetch one extra row to tell if there is another page
+        rows = db.session.execute(query.order_by(username_lower, User.username).limit(limit + 1)).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        response = jsonify({
+            'users': [{'username': row.username, 'user_id': row.user_id} for row in rows],
+            'next': rows[-1].username if has_more else None
+        })
+
+    return conditional_response(response, etag)
 
 @app.route('/mykeys', methods=['GET', 'POST'])
 @login_required
@@ -266,23 +780,26 @@ def mykeys():
 
     if request.method == 'POST':
 
-        # Get all keys for the current user
-        # user1 is always the request sender
-        mykeys = EncryptedKeys.query.filter_by(user1_id=current_user.user_id).all() + EncryptedKeys.query.filter_by(user2_id=current_user.user_id).all()
-        keys = []
-        for key in mykeys:
-            if key.user1_id == current_user.user_id:
-                keys.append({
-                    'user_id': key.user2_id,
-                    'username': User.query.filter_by(user_id=key.user2_id).first().username,
-                    'encrypted_key': key.encrypted_key_1
-                })
-            else:
-                keys.append({
-                    'user_id': key.user1_id,
-                    'username': User.query.filter_by(user_id=key.user1_id).first().username,
-                    'encrypted_key': key.encrypted_key_2
-                })
+        # Get all keys for the current user, with the peer's username, in one query.
+        # Pairs are stored sorted, so the current user may be either user1 or user2:
+        # each branch of the UNION picks the peer and our half of the key for one side.
+        as_user1 = select(
+            EncryptedKeys.user2_id.label('user_id'),
+            User.username,
+            EncryptedKeys.encrypted_key_1.label('encrypted_key')
+        ).join(User, User.user_id == EncryptedKeys.user2_id).where(EncryptedKeys.user1_id == current_user.user_id)
+        as_user2 = select(
+            EncryptedKeys.user1_id.label('user_id'),
+            User.username,
+            EncryptedKeys.encrypted_key_2.label('encrypted_key')
+        ).join(User, User.user_id == EncryptedKeys.user1_id).where(EncryptedKeys.user2_id == current_user.user_id)
+
+        rows = db.session.execute(union_all(as_user1, as_user2)).all()
+        keys = [{
+            'user_id': row.user_id,
+            'username': row.username,
+            'encrypted_key': row.encrypted_key
+        } for row in rows]
 
         return jsonify({'keys': keys}), 200
     
@@ -314,6 +831,7 @@ def register():
             - If any required field is missing, returns a JSON response with an error message and a 400 status code.
             - If the user already exists, returns a JSON response with an error message and a 400 status code.
             - If registration is successful, returns a JSON response with a success message and a 201 status code.
+            - If the password hashing queue is full, returns a 503 status code (see `password_busy`).
     """
 
     if request.method == 'GET':
@@ -341,7 +859,8 @@ def register():
         user_id = str(uuid.uuid4())
         
         # Hash the password using Bcrypt
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        with metrics.timed('bcrypt_hash'):
+            hashed_password = password_hasher.generate_password_hash(password)
         print(f"Hashed Password: {hashed_password}")
         
         # Create new user
@@ -372,11 +891,13 @@ def login():
         - On POST:
             - If email or password is missing, returns a JSON response with an error message and HTTP 400 status.
             - If the user is not found or credentials are invalid, returns a JSON response with an error message and HTTP 401 status.
+            - If the user is banned or deleted, returns a JSON response with an error message and HTTP 403 status.
             - If authentication is successful:
                 - Logs in the user.
                 - Updates the user's last login timestamp.
                 - Commits the changes to the database.
                 - Returns a JSON response with a success message and HTTP 200 status.
+            - If the password hashing queue is full, returns HTTP 503 (see `password_busy`).
     """
     if request.method == 'GET':
         return render_template('auth/login.html')
@@ -394,12 +915,17 @@ def login():
         if not user:
             return jsonify({'error': 'Invalid credentials'}), 401
         
-        if not bcrypt.check_password_hash(user.password, password):
+        with metrics.timed('bcrypt_check'):
+            password_ok = password_hasher.check_password_hash(user.password, password)
+        if not password_ok:
             return jsonify({'error': 'Invalid credentials'}), 401
         
-        login_user(user)
+        if not login_user(user):
+            return jsonify({'error': 'This account is disabled'}), 403
+
         user.last_login = datetime.datetime.now()
         db.session.commit()
+        user_cache.delete(user.user_id)
 
         return jsonify({'message': 'Login successful'}), 200
 
@@ -412,6 +938,219 @@ def logout():
     return redirect(url_for('login'))
 
 
+def serialize_message(message):
+    """
+    Convert a `Message` row into the JSON-serializable dict sent to clients.
+    """
+    return {
+        "id": message.id,
+        "sender_id": str(message.sender_id),
+        "receiver_id": str(message.receiver_id),
+        "encrypted_message": message.encrypted_message,
+        "timestamp": message.timestamp.isoformat()
+    }
+
+
+# The columns `serialize_message` reads, so large results skip building ORM objects
+MESSAGE_COLUMNS = (Message.id, Message.sender_id, Message.receiver_id, Message.encrypted_message, Message.timestamp)
+
+def iter_messages(query):
+    """
+    Yield the rows of a `select(*MESSAGE_COLUMNS)` query serialized for clients,
+    fetching STREAM_BATCH_SIZE rows at a time instead of loading the whole result.
+    """
+    result = db.session.execute(query.execution_options(yield_per=app.config['STREAM_BATCH_SIZE']))
+    try:
+        for row in result:
+            yield serialize_message(row)
+    finally:
+        result.close()
+
+
+def iter_archived_messages(conversation_id, after=None, before=None, descending=False):
+    """
+    Yield the archived messages of a conversation with `after` < id < `before`,
+    oldest first or, with `descending`, newest first. Segments are only read
+    as far as the caller iterates.
+    """
+    query = select(ArchiveSegment.path).where(ArchiveSegment.conversation_id == conversation_id)
+    if after is not None:
+        query = query.where(ArchiveSegment.last_message_id > after)
+    if before is not None:
+        query = query.where(ArchiveSegment.first_message_id < before)
+    order = ArchiveSegment.last_message_id.desc() if descending else ArchiveSegment.last_message_id.asc()
+
+    for path in db.session.execute(query.order_by(order)).scalars().all():
+        messages = message_archive.read_segment(path)
+        for message in (reversed(messages) if descending else messages):
+            if (after is None or message["id"] > after) and (before is None or message["id"] < before):
+                yield message
+
+
+def archive_old_messages(cutoff, segment_size):
+    """
+    Move the messages sent before `cutoff` out of the message table into
+    archive segments of up to `segment_size` messages.
+    Only the oldest run of each conversation is moved, so a conversation's
+    archived messages always have lower ids than its live ones, and the newest
+    message always stays in the table for the inbox. Each segment is written to
+    disk first and then recorded, deleted from the table and committed in one
+    transaction; an interrupted run can simply be started again.
+    Returns:
+        dict: How many conversations, segments and messages were archived.
+    """
+    totals = {"conversations": 0, "segments": 0, "messages": 0}
+    conversations = db.session.execute(select(Conversation.id, Conversation.last_message_id)).all()
+
+    for conversation_id, last_message_id in conversations:
+        archived = False
+        while True:
+            rows = db.session.execute(
+                select(*MESSAGE_COLUMNS)
+                .where(Message.conversation_id == conversation_id, Message.id < last_message_id)
+                .order_by(Message.id.asc())
+                .limit(segment_size)
+            ).all()
+            old = list(itertools.takewhile(lambda row: row.timestamp is not None and row.timestamp < cutoff, rows))
+            if not old:
+                break
+
+            messages = [serialize_message(row) for row in old]
+            first_id, last_id = messages[0]["id"], messages[-1]["id"]
+            path = message_archive.segment_path(conversation_id, first_id, last_id)
+            message_archive.write_segment(path, messages)
+
+            db.session.add(ArchiveSegment(
+                conversation_id=conversation_id,
+                first_message_id=first_id,
+                last_message_id=last_id,
+                message_count=len(messages),
+                path=path
+            ))
+            Message.query.filter(
+                Message.conversation_id == conversation_id,
+                Message.id.between(first_id, last_id)
+            ).delete(synchronize_session=False)
+            Conversation.query.filter_by(id=conversation_id).update({'archived_through': last_id})
+            db.session.commit()
+
+            archived = True
+            totals["segments"] += 1
+            totals["messages"] += len(messages)
+            if len(old) < segment_size:
+                break
+
+        totals["conversations"] += archived
+
+    return totals
+
+
+def json_stream_response(generator, **kwargs):
+    """Send a JSON document produced piece by piece by `generator`."""
+    return Response(stream_with_context(generator), mimetype="application/json", **kwargs)
+
+
+def store_messages(records, recovering=False):
+    """
+    Insert message records in one transaction and push each stored message to
+    both participants.
+    Each record is a dict with `sender_id`, `receiver_id`, `encrypted_message`
+    and an ISO-format `timestamp`. With `recovering`, records that are already
+    in the table (replayed from the ingest journal after a crash) are skipped.
+    Returns:
+        list: The stored `Message` objects, with their ids.
+    """
+
+    messages = [
+        Message(
+            conversation_id=conversation_key(r["sender_id"], r["receiver_id"]),
+            sender_id=r["sender_id"],
+            receiver_id=r["receiver_id"],
+            encrypted_message=r["encrypted_message"],
+            timestamp=datetime.datetime.fromisoformat(r["timestamp"])
+        ) for r in records
+    ]
+
+    if recovering:
+        existing = {
+            (m.conversation_id, m.sender_id, m.timestamp, m.encrypted_message)
+            for m in Message.query.filter(
+                Message.conversation_id.in_({m.conversation_id for m in messages}),
+                Message.timestamp.in_({m.timestamp for m in messages})
+            )
+        }
+        messages = [
+            m for m in messages
+            if (m.conversation_id, m.sender_id, m.timestamp, m.encrypted_message) not in existing
+        ]
+
+    if not messages:
+        return messages
+
+    # Lock the conversations first, so ids are assigned in commit order (see claim_conversations)
+    claim_conversations(messages)
+    # Added together, SQLAlchemy sends them as batched multi-row INSERTs
+    db.session.add_all(messages)
+    db.session.flush()
+    update_conversations(messages)
+    db.session.commit()
+
+    # Push the stored messages to both participants
+    for message in messages:
+        payload = serialize_message(message)
+        hub.publish(f"user:{message.receiver_id}", payload)
+        hub.publish(f"user:{message.sender_id}", payload)
+
+    return messages
+
+
+# Write-behind ingestion (INGEST_MODE=write_behind), started by the first request
+ingest_queue = None
+ingest_lock = threading.Lock()
+
+def get_ingest_queue():
+    global ingest_queue
+    if ingest_queue is not None:
+        return ingest_queue
+    with ingest_lock:
+        if ingest_queue is not None:
+            return ingest_queue
+
+        def persist(records, recovering=False):
+            with app.app_context():
+                store_messages(records, recovering=recovering)
+
+        ingest_queue = IngestQueue(
+            app.config['INGEST_JOURNAL_PATH'],
+            persist,
+            max_size=app.config['INGEST_QUEUE_SIZE'],
+            batch_size=app.config['INGEST_BATCH_SIZE'],
+            max_retry_seconds=app.config['INGEST_MAX_RETRY_SECONDS'],
+            # The data itself was rejected: retrying cannot help, unlike e.g. OperationalError
+            permanent_errors=(IntegrityError, DataError)
+        ).start()
+        # Everything accepted must reach the database before the process exits
+        atexit.register(ingest_queue.close)
+        return ingest_queue
+
+
+@app.before_request
+def start_ingest_queue():
+    if app.config['INGEST_MODE'] == 'write_behind' and ingest_queue is None:
+        get_ingest_queue()
+
+
+@app.errorhandler(IngestQueueFull)
+def ingest_busy(error):
+    """
+    The write-behind queue is full, the database writer is behind.
+    Ask the client to retry instead of accepting more than we can hold.
+    """
+    response = jsonify({'error': 'Server is busy, please try again'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
 @app.route("/send_message", methods=["POST"])
 @login_required
 def send_message():
@@ -419,17 +1158,21 @@ def send_message():
     Handles the sending of an encrypted message from the current user to a specified receiver.
     This function retrieves the JSON payload from the request, extracts the receiver ID and 
     encrypted message, validates the input, and stores the message in the database.
+    Once stored, the message is published to both the sender's and the receiver's
+    event channels so connected clients receive it without polling.
+    With INGEST_MODE=write_behind the message is instead appended to the durable
+    ingest journal and acknowledged right away; a background writer inserts it
+    in a batch shortly after.
     Returns:
         Response: A JSON response indicating success or failure of the operation.
-                  - On success: {"message": "Message sent successfully!"}, status code 200.
+                  - On success: {"message": "Message sent successfully!", "id": <message id>}, status code 200.
+                  - In write-behind mode: {"message": "Message accepted", "timestamp": ...}, status code 202.
                   - On failure: {"error": "Invalid request"}, status code 400.
-    Raises:
-        KeyError: If the JSON payload is missing required keys.
-        Exception: If there is an issue committing the message to the database.
+                  - If the receiver does not exist: {"error": "Receiver not found"}, status code 404.
+                  - If the write-behind queue is full: status code 503 (see `ingest_busy`).
     Notes:
         - The `current_user` object is expected to provide the ID of the currently authenticated user.
         - The `Message` model is used to represent the message entity in the database.
-        - The `db.session` is used to interact with the database.
     Example:
         Input JSON payload:
         {
@@ -444,41 +1187,505 @@ def send_message():
 
     if not receiver_id or not encrypted_message:
         return jsonify({"error": "Invalid request"}), 400
+    # Checked up front: in write-behind mode a foreign key violation would only surface in the writer
+    if db.session.execute(select(User.id).where(User.user_id == str(receiver_id))).first() is None:
+        return jsonify({"error": "Receiver not found"}), 404
+
+    record = {
+        "sender_id": current_user.user_id,
+        "receiver_id": str(receiver_id),
+        "encrypted_message": encrypted_message,
+        "timestamp": datetime.datetime.now().isoformat()
+    }
 
-    message = Message(
-        sender_id=current_user.user_id,
-        receiver_id=receiver_id,
-        encrypted_message=encrypted_message,
-        timestamp=datetime.datetime.now()
-    )
-    db.session.add(message)
-    db.session.commit()
-    return jsonify({"message": "Message sent successfully!"})
+    if app.config['INGEST_MODE'] == 'write_behind':
+        get_ingest_queue().submit(record)
+        return jsonify({"message": "Message accepted", "timestamp": record["timestamp"]}), 202
+
+    message = store_messages([record])[0]
+    return jsonify({"message": "Message sent successfully!", "id": message.id})
 
 
 @app.route("/get_messages/<uuid:user_id>", methods=["GET"])
 @login_required
 def get_messages(user_id):
+    """
+    Returns one page of the messages exchanged between the current user and `user_id`.
+    Two modes are supported, both paged by message id so a page costs the same
+    no matter how long the conversation is:
+        - History (default): the newest messages first. Pass the returned `before`
+          back as `?before=<id>` to load the next, older page.
+        - Sync (`?since=<id>`): the messages newer than `since`, oldest first.
+          Pass the returned `cursor` back as `since` on the next poll.
+    Query parameters:
+        since (int): Id of the last message the client already has.
+        before (int): Only return messages older than this id.
+        limit (int): Maximum number of messages to return (capped by MESSAGES_MAX_PAGE_SIZE).
+    Returns:
+        Response: A JSON object with:
+            - messages: the page of messages.
+            - cursor: the newest message id seen so far; pass it as `since` to poll for newer messages.
+            - before: the oldest message id in the page (history mode only).
+            - has_more: True if more messages are waiting beyond this page.
+        Responses carry an ETag built from the conversation's last message id,
+        so a repeated request with a matching `If-None-Match` is answered with
+        304 from the `conversations` row alone, without reading any messages.
+    """
 
     if not user_id:
         return jsonify({"error": "Invalid request"}), 400
-    
-    # Get all messages between the current user and the specified user
-    messages = Message.query.filter(
-        or_(
-            and_(Message.sender_id == current_user.user_id, Message.receiver_id == str(user_id)),
-            and_(Message.receiver_id == current_user.user_id, Message.sender_id == str(user_id))
-        )
-    ).order_by(Message.timestamp.asc()).all()
 
-    return jsonify([
-        {
-            "sender_id": str(m.sender_id),
-            "receiver_id": str(m.receiver_id),
-            "encrypted_message": m.encrypted_message,
-            "timestamp": m.timestamp.isoformat()
-        } for m in messages
-    ])
+    since = request.args.get("since", type=int)
+    before = request.args.get("before", type=int)
+    limit = request.args.get("limit", app.config['MESSAGES_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['MESSAGES_MAX_PAGE_SIZE']))
+
+    conversation_id = conversation_key(current_user.user_id, user_id)
+
+    # A page only changes when a message is added to the conversation
+    last_message_id, archived_through = db.session.execute(
+        select(Conversation.last_message_id, Conversation.archived_through).where(Conversation.id == conversation_id)
+    ).first() or (0, 0)
+    etag = f"{conversation_id}-{last_message_id}-{since}-{before}-{limit}"
+    if request.if_none_match.contains(etag):
+        return conditional_response(Response(status=304), etag)
+
+    # Get the messages between the current user and the specified user
+    query = select(*MESSAGE_COLUMNS).where(Message.conversation_id == conversation_id)
+
+    # Fetch one extra row to tell if there is another page
+    if since is not None:
+        query = query.where(Message.id > since).order_by(Message.id.asc())
+    else:
+        if before is not None:
+            query = query.where(Message.id < before)
+        query = query.order_by(Message.id.desc())
+    query = query.limit(limit + 1)
+
+    # The page is streamed, so the fields that depend on its rows are
+    # collected on the way and written after the list
+    page = {"first": None, "last": None, "has_more": False}
+
+    # Old messages may have been moved to the archive: they all have lower ids
+    # than the ones in the table, so history continues into the archive once
+    # the table runs out, and a sync from an old cursor starts there
+    def rows():
+        if since is not None:
+            if since < archived_through:
+                yield from iter_archived_messages(conversation_id, after=since)
+            yield from iter_messages(query)
+        else:
+            yield from iter_messages(query)
+            yield from iter_archived_messages(conversation_id, before=before, descending=True)
+
+    def messages():
+        for i, message in enumerate(rows()):
+            if i == limit:
+                page["has_more"] = True
+                break
+            if page["first"] is None:
+                page["first"] = message["id"]
+            page["last"] = message["id"]
+            yield message
+
+    def trailer():
+        fields = {"has_more": page["has_more"]}
+        if since is not None:
+            fields["cursor"] = page["last"] if page["last"] is not None else since
+        else:
+            fields["cursor"] = page["first"] or 0
+            fields["before"] = page["last"]
+        return fields
+
+    return conditional_response(json_stream_response(stream_json_list("messages", messages(), trailer)), etag)
+
+
+@app.route("/export_messages/<uuid:user_id>", methods=["GET"])
+@login_required
+def export_messages(user_id):
+    """
+    Downloads the whole conversation between the current user and `user_id`,
+    oldest first, as one JSON document: {"messages": [...]} with the same
+    message objects as `get_messages`.
+    The document is streamed while the rows are read, STREAM_BATCH_SIZE at a
+    time, so memory use does not grow with the length of the conversation.
+    """
+
+    conversation_id = conversation_key(current_user.user_id, user_id)
+    query = select(*MESSAGE_COLUMNS).where(
+        Message.conversation_id == conversation_id
+    ).order_by(Message.id.asc())
+
+    # Archived messages are the oldest ones, then the table continues
+    messages = itertools.chain(iter_archived_messages(conversation_id), iter_messages(query))
+
+    return json_stream_response(stream_json_list("messages", messages), headers={
+        "Content-Disposition": f'attachment; filename="messages-{user_id}.json"'
+    })
+
+
+@app.route("/api/conversations", methods=["GET"])
+@login_required
+def get_conversations():
+    """
+    Returns the current user's inbox: one entry per conversation, most recent first.
+    Each entry comes from the `conversations` summary table, so the cost grows
+    with the number of contacts, not with the number of messages.
+    Returns:
+        Response: A JSON object with `conversations`, each holding:
+            - user_id / username: the other participant.
+            - unread: how many of their messages the current user has not read.
+            - last_message: the newest message of the conversation (still encrypted).
+    """
+
+    # Pairs are stored sorted, so each branch of the UNION picks the peer
+    # and our unread counter for one side, like the /mykeys query
+    as_user1 = select(
+        Conversation.user2_id.label('user_id'),
+        Conversation.unread_1.label('unread'),
+        Conversation.last_message_id
+    ).where(Conversation.user1_id == current_user.user_id)
+    as_user2 = select(
+        Conversation.user1_id.label('user_id'),
+        Conversation.unread_2.label('unread'),
+        Conversation.last_message_id
+    ).where(Conversation.user2_id == current_user.user_id)
+    inbox = union_all(as_user1, as_user2).subquery()
+
+    rows = db.session.execute(
+        select(inbox.c.user_id, inbox.c.unread, User.username, Message)
+        .join(User, User.user_id == inbox.c.user_id)
+        .join(Message, Message.id == inbox.c.last_message_id)
+        .order_by(inbox.c.last_message_id.desc())
+    ).all()
+
+    conversations = [{
+        'user_id': row.user_id,
+        'username': row.username,
+        'unread': row.unread,
+        'last_message': serialize_message(row.Message)
+    } for row in rows]
+
+    return jsonify({'conversations': conversations}), 200
+
+
+@app.route("/api/conversations/<uuid:user_id>/read", methods=["POST"])
+@login_required
+def mark_conversation_read(user_id):
+    """
+    Marks the conversation with `user_id` as read for the current user,
+    resetting their unread counter. Only our own side of the row is touched.
+    Returns:
+        Response: {"message": "Conversation marked as read"}, status code 200.
+    """
+
+    user1_id, _ = sorted((current_user.user_id, str(user_id)))
+    unread = 'unread_1' if current_user.user_id == user1_id else 'unread_2'
+
+    Conversation.query.filter_by(id=conversation_key(current_user.user_id, user_id)).update({unread: 0})
+    db.session.commit()
+
+    return jsonify({'message': 'Conversation marked as read'}), 200
+
+
+@app.route("/events", methods=["GET"])
+@login_required
+def events():
+    """
+    Server-Sent Events stream of the messages sent to or by the current user.
+    Each event is named `message` and carries the same JSON object as
+    `get_messages`. A comment line is sent every EVENTS_HEARTBEAT_SECONDS to
+    keep proxies from closing an idle connection.
+    """
+
+    subscription = hub.subscribe(f"user:{current_user.user_id}")
+    heartbeat = app.config['EVENTS_HEARTBEAT_SECONDS']
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not subscription.closed:
+                payload = subscription.get(timeout=heartbeat)
+                if payload is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: message\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+@app.cli.group('keyforge')
+def keyforge_cli():
+    """KeyForge maintenance commands."""
+
+
+@keyforge_cli.command('archive')
+@click.option('--older-than-days', type=int, default=None,
+              help='Archive messages older than this many days (default: ARCHIVE_AFTER_DAYS).')
+@click.option('--segment-size', type=int, default=None,
+              help='Most messages per archive segment (default: ARCHIVE_SEGMENT_SIZE).')
+def archive_command(older_than_days, segment_size):
+    """
+    Move old messages from the message table into compressed archive segments.
+    get_messages and /export_messages keep serving them from the archive.
+    """
+    days = older_than_days if older_than_days is not None else app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+
+    totals = archive_old_messages(cutoff, segment_size or app.config['ARCHIVE_SEGMENT_SIZE'])
+    click.echo(f"Archived {totals['messages']} messages sent before {cutoff:%Y-%m-%d %H:%M} "
+               f"from {totals['conversations']} conversations into {totals['segments']} segments "
+               f"in {app.config['ARCHIVE_DIR']}")
+
+
+# Tables in the order they are exported and imported, so foreign keys always resolve
+TRANSFER_TABLES = (User, EncryptedKeys, Message, Conversation, ArchiveSegment, Counter)
+
+def schema_revision(connection):
+    """The Alembic revision the database is at, or None if it is not managed by migrations."""
+    if not db.inspect(connection).has_table('alembic_version'):
+        return None
+    return connection.execute(text('SELECT version_num FROM alembic_version')).scalar()
+
+def progress_reporter(verb, interval=2.0):
+    """A `progress(table, rows)` callback that prints at most every `interval` seconds."""
+    last = time.monotonic()
+
+    def report(table, rows):
+        nonlocal last
+        now = time.monotonic()
+        if now - last >= interval:
+            click.echo(f"  {table}: {rows:,} rows {verb}", err=True)
+            last = now
+    return report
+
+@keyforge_cli.command('export')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--compress/--no-compress', default=None,
+              help='gzip the output (default: when PATH ends in .gz).')
+@click.option('--batch-size', type=int, default=10000, show_default=True,
+              help='Rows fetched from the database at a time.')
+def export_command(path, compress, batch_size):
+    """
+    Export users, encrypted keys, messages and conversation state to PATH as
+    newline-delimited JSON. Rows are streamed, so memory use stays flat however
+    large the database is. Archive segment files are not included: copy
+    ARCHIVE_DIR along with the export.
+    """
+    tables = [model.__table__ for model in TRANSFER_TABLES]
+    started = time.perf_counter()
+
+    with db.engine.connect() as connection:
+        # Read all tables from one snapshot while the server keeps writing
+        if connection.dialect.name == 'postgresql':
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        elif connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql('BEGIN')
+
+        header = {
+            'created_at': datetime.datetime.now().isoformat(),
+            'schema_revision': schema_revision(connection),
+        }
+        with transfer.open_dump(path, 'w', compress) as out:
+            counts = transfer.export_tables(connection, tables, out, header, batch_size,
+                                            progress_reporter('exported'))
+        connection.rollback()
+
+    summary = ', '.join(f"{rows:,} {table}" for table, rows in counts.items())
+    click.echo(f"Exported {summary} to {path} in {time.perf_counter() - started:.1f}s")
+
+@keyforge_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=5000, show_default=True,
+              help='Rows inserted per statement and transaction.')
+@click.option('--checkpoint', 'checkpoint_path', default=None,
+              help='Progress file of this import (default: PATH.checkpoint).')
+@click.option('--restart', is_flag=True,
+              help='Ignore the checkpoint of an earlier, interrupted import.')
+def import_command(path, batch_size, checkpoint_path, restart):
+    """
+    Import an export written by `flask keyforge export` into this database,
+    which must be empty and migrated to the same revision. Rows are inserted
+    in batches, and an interrupted import resumes where it stopped when run
+    again with the same file.
+    """
+    tables = {model.__tablename__: model.__table__ for model in TRANSFER_TABLES}
+    checkpoint = transfer.ImportCheckpoint(checkpoint_path or f"{path}.checkpoint", path)
+    if restart:
+        checkpoint.clear()
+
+    try:
+        resuming = checkpoint.load() > 0
+    except ValueError as error:
+        raise click.ClickException(f"{error}; use --restart to start over")
+
+    with db.engine.connect() as connection:
+        revision = schema_revision(connection)
+        # Counters are seeded by the migrations and replaced by the exported ones,
+        # everything else must be empty
+        data_tables = [table for table in tables.values() if table is not Counter.__table__]
+        if not resuming and any(connection.execute(select(table).limit(1)).first() for table in data_tables):
+            raise click.ClickException("The database already holds data; import into an empty database")
+        if not resuming:
+            connection.execute(Counter.__table__.delete())
+            connection.commit()
+
+    started = time.perf_counter()
+    with transfer.open_dump(path, 'r') as f:
+        lines = iter(f)
+        try:
+            header = transfer.read_header(lines)
+        except ValueError as error:
+            raise click.ClickException(str(error))
+        if header.get('schema_revision') != revision:
+            raise click.ClickException(
+                f"The export was made at schema revision {header.get('schema_revision')}, "
+                f"this database is at {revision}; migrate it first"
+            )
+        if resuming:
+            click.echo(f"Resuming after record {checkpoint.load():,}", err=True)
+
+        try:
+            counts = transfer.import_records(
+                db.engine, tables, lines,
+                dialect_insert, checkpoint, batch_size, progress_reporter('imported')
+            )
+        except ValueError as error:
+            raise click.ClickException(f"{error}; the records before it were imported")
+
+    with db.engine.begin() as connection:
+        # Directory listings clients cached before the import must not match anymore
+        bump_counter(connection, 'users')
+        if connection.dialect.name == 'postgresql':
+            # Ids were inserted explicitly, so move the sequences past them
+            for table in data_tables:
+                if 'id' in table.c and isinstance(table.c.id.type, db.Integer):
+                    connection.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                        f"COALESCE(MAX(id), 0) + 1, false) FROM {table.name}"
+                    ))
+    checkpoint.clear()
+
+    summary = ', '.join(f"{rows:,} {table}" for table, rows in counts.items()) or 'nothing new'
+    click.echo(f"Imported {summary} from {path} in {time.perf_counter() - started:.1f}s")
+
+
+@keyforge_cli.command('rotate-keys')
+@click.option('--user', 'user_ids', multiple=True,
+              help='Only rotate the keys of pairs involving this user id (repeatable).')
+@click.option('--before', type=click.DateTime(), default=None,
+              help='Only rotate keys last updated before this date.')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='Pairs encrypted and committed at a time.')
+@click.option('--workers', type=int, default=None,
+              help='Encryption processes (default: KDC_WORKERS).')
+@click.option('--checkpoint', 'checkpoint_path', default=None,
+              help='Progress file of this rotation (default: instance/rotate-keys.checkpoint).')
+@click.option('--restart', is_flag=True,
+              help='Ignore the checkpoint of an earlier, interrupted rotation.')
+def rotate_keys_command(user_ids, before, batch_size, workers, checkpoint_path, restart):
+    """
+    Generate new session keys for every user pair in encrypted_keys, or the
+    pairs selected by --user and --before, and encrypt them for both users
+    with their stored public keys. Encryption runs on a process pool and
+    results are committed batch by batch; an interrupted rotation resumes
+    where it stopped when run again with the same options.
+    Messages already sent stay encrypted with the previous session key.
+    """
+    checkpoint_path = checkpoint_path or os.path.join(app.instance_path, 'rotate-keys.checkpoint')
+    selection = {'users': sorted(user_ids), 'before': before.isoformat() if before else None}
+    state = {'selection': selection, 'last_id': 0, 'rotated': 0, 'skipped': 0}
+
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state['selection'] != selection:
+            raise click.ClickException(
+                f"{checkpoint_path} belongs to a rotation with other options ({state['selection']}); "
+                "use --restart to start over"
+            )
+        click.echo(f"Resuming after pair {state['last_id']} ({state['rotated']:,} rotated so far)", err=True)
+
+    def save_checkpoint():
+        os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+        with open(checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    workers = workers or app.config['KDC_WORKERS']
+    report = progress_reporter('rotated')
+    started = time.perf_counter()
+    rotated = 0
+
+    # spawn, like the server's pool, so workers start clean
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) if workers > 1 else None
+    # A few chunks per worker keeps them all busy without much IPC per pair
+    chunksize = max(1, batch_size // (workers * 4))
+    try:
+        for last_id, batch_rotated, batch_skipped in rotate_encrypted_keys(
+            state['last_id'], list(user_ids), before, batch_size, executor, chunksize
+        ):
+            state.update(last_id=last_id, rotated=state['rotated'] + batch_rotated,
+                         skipped=state['skipped'] + batch_skipped)
+            save_checkpoint()
+            rotated += batch_rotated
+            report('encrypted_keys', state['rotated'])
+    finally:
+        if executor:
+            executor.shutdown()
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    elapsed = time.perf_counter() - started
+    click.echo(f"Rotated {state['rotated']:,} session keys in {elapsed:.1f}s ({rotated / elapsed:,.0f} pairs/s), "
+               f"skipped {state['skipped']:,} pairs where a user has no public key")
+
+
+@metrics.registry.add_collector
+def component_metrics():
+    """Export the statistics the caches, the password hasher and the ingest queue keep themselves."""
+    hasher = password_hasher.stats()
+    yield ('keyforge_password_rejected_total', 'counter', 'Password operations rejected because the hashing queue was full',
+           [({'operation': op}, values['rejected']) for op, values in hasher.items()])
+
+    caches = {'public_keys': public_keys.stats(), 'users': user_cache.stats()}
+    yield ('keyforge_cache_hits_total', 'counter', 'Cache hits',
+           [({'cache': name}, stats['hits']) for name, stats in caches.items()])
+    yield ('keyforge_cache_misses_total', 'counter', 'Cache misses',
+           [({'cache': name}, stats['misses']) for name, stats in caches.items()])
+    yield ('keyforge_cache_entries', 'gauge', 'Entries held by in-process caches',
+           [({'cache': name}, stats['size']) for name, stats in caches.items() if 'size' in stats])
+
+    if ingest_queue is not None:
+        ingest = ingest_queue.stats()
+        yield ('keyforge_ingest_accepted_total', 'counter', 'Messages accepted by the write-behind queue', [({}, ingest['accepted'])])
+        yield ('keyforge_ingest_persisted_total', 'counter', 'Messages written to the database by the write-behind queue', [({}, ingest['persisted'])])
+        yield ('keyforge_ingest_dead_lettered_total', 'counter', 'Messages the write-behind queue could not store, kept in the dead-letter file', [({}, ingest['dead_lettered'])])
+        yield ('keyforge_ingest_queued', 'gauge', 'Messages waiting in the write-behind queue', [({}, ingest['queued'])])
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Prometheus metrics of this process: request latency, SQL queries and time,
+    and response sizes per endpoint, RSA and bcrypt timings, and cache, password
+    hashing and ingest queue statistics.
+    If METRICS_TOKEN is set, the scraper must send `Authorization: Bearer <token>`.
+    Each worker process keeps its own metrics, so scrape every worker.
+    """
+
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class MessageArchive:
+    """
+    Cold storage for old messages: compressed, append-only segment files on
+    local disk, one directory per conversation.
+
+    A segment holds a run of consecutive messages of one conversation, as the
+    JSON objects clients receive (one per line, oldest first), gzip-compressed.
+    Segments are written once and never modified; archiving more messages adds
+    new segments. Which segments exist is recorded in the database by the
+    caller, this class only deals with the files. The last `cache_size`
+    segments read are kept decoded in memory, since clients scrolling back
+    through history read the same segment several times in a row.
+    """
+
+    def __init__(self, root, cache_size=32):
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def segment_path(self, conversation_id, first_message_id, last_message_id) -> str:
+        """Path of a segment, relative to the archive root."""
+        directory = conversation_id.replace(":", "_")  # Not a valid file name character everywhere
+        return os.path.join(directory, f"{first_message_id:012d}-{last_message_id:012d}.jsonl.gz")
+
+    def write_segment(self, path, messages):
+        """
+        Durably write `messages` (serialized, oldest first) to the segment at `path`.
+        The file only appears under its final name once it is complete, so a
+        crash never leaves a truncated segment behind; writing the same segment
+        again after a crash simply replaces it.
+        """
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        tmp_path = full_path + ".tmp"
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+                for message in messages:
+                    f.write(json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, full_path)
+
+    def read_segment(self, path):
+        """The messages of the segment at `path`, oldest first."""
+        with self._lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                return self._cache[path]
+
+        with gzip.open(os.path.join(self.root, path), "rt", encoding="utf-8") as f:
+            messages = [json.loads(line) for line in f]
+
+        with self._lock:
+            self._cache[path] = messages
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return messages
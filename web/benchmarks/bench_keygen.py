@@ -0,0 +1,75 @@
+"""
+Benchmark: RSA key generation latency percentiles.
+
+Usage (from the web/ directory):
+    python benchmarks/bench_keygen.py [--sizes 512 1024 2048] [--runs 50] [--legacy]
+
+--legacy also times the previous generator (raw random candidates plus a
+5-round Fermat test) for comparison.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rsa import RSA
+
+
+class LegacyRSA(RSA):
+    # The generator RSA used before sieving and Miller-Rabin
+    def _generate_large_prime(self, bits):
+        while True:
+            p = random.getrandbits(bits)
+            if self._is_fermat_prime(p):
+                return p
+
+    def _is_fermat_prime(self, n, k=5):
+        if n < 4: return False
+        for _ in range(k):
+            a = random.randint(2, n - 2)
+            if pow(a, n - 1, n) != 1:
+                return False
+        return True
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def bench(rsa, bits, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        rsa.generate_key_pair(bits // 2)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048], help="modulus sizes in bits")
+    parser.add_argument("--runs", type=int, default=50, help="key pairs generated per size")
+    parser.add_argument("--legacy", action="store_true", help="also time the legacy generator")
+    args = parser.parse_args()
+
+    generators = [("sieve+mr", RSA())]
+    if args.legacy:
+        generators.append(("legacy", LegacyRSA()))
+
+    print(f"{'bits':>6} {'generator':>10} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)")
+    for bits in args.sizes:
+        for name, rsa in generators:
+            samples = bench(rsa, bits, args.runs)
+            print(f"{bits:>6} {name:>10} {statistics.mean(samples):>9.1f} "
+                  f"{percentile(samples, 50):>9.1f} {percentile(samples, 90):>9.1f} "
+                  f"{percentile(samples, 99):>9.1f} {max(samples):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
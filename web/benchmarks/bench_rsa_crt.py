@@ -0,0 +1,50 @@
+"""
+Micro-benchmark: RSA decryption with the plain private exponent vs. CRT.
+
+Usage (from the web/ directory):
+    python benchmarks/bench_rsa_crt.py [--sizes 512 1024 2048] [--rounds 200]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rsa import RSA
+
+
+def time_decrypt(rsa, ciphertext, private_key, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        rsa.decrypt(ciphertext, private_key)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048], help="modulus sizes in bits")
+    parser.add_argument("--rounds", type=int, default=200, help="decryptions timed per path")
+    args = parser.parse_args()
+
+    rsa = RSA()
+    plaintext = "17"  # a Caesar key, the payload the KDC actually encrypts
+
+    print(f"{'bits':>6} {'plain (ms)':>12} {'crt (ms)':>12} {'speedup':>8}")
+    for bits in args.sizes:
+        (e, n), (d, _, p, q, dp, dq, qinv) = rsa.generate_key_pair(bits // 2)
+        public_key = json.dumps({"e": str(e), "n": str(n)})
+        plain_key = json.dumps({"d": str(d), "n": str(n)})
+        crt_key = json.dumps({k: str(v) for k, v in dict(d=d, n=n, p=p, q=q, dp=dp, dq=dq, qinv=qinv).items()})
+
+        ciphertext = rsa.encrypt(plaintext, public_key)
+        assert rsa.decrypt(ciphertext, plain_key) == rsa.decrypt(ciphertext, crt_key) == plaintext
+
+        plain = time_decrypt(rsa, ciphertext, plain_key, args.rounds)
+        crt = time_decrypt(rsa, ciphertext, crt_key, args.rounds)
+        print(f"{n.bit_length():>6} {plain * 1000:>12.3f} {crt * 1000:>12.3f} {plain / crt:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
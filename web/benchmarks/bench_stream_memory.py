@@ -0,0 +1,132 @@
+"""
+Benchmark: memory use while downloading a very long conversation.
+
+Usage (from the web/ directory):
+    python benchmarks/bench_stream_memory.py [--messages 1000000] [--buffered]
+
+Seeds a throwaway SQLite database with one conversation of --messages
+messages, downloads it through /export_messages and prints the process RSS
+as the response is consumed. The RSS should stay flat while the document
+streams. --buffered afterwards builds the same document the way responses
+used to be built (a list of dicts, then one JSON string) for comparison.
+"""
+import argparse
+import datetime
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+WORKDIR = tempfile.mkdtemp(prefix="keyforge-bench-")
+DB_PATH = os.path.join(WORKDIR, "bench.sqlite3")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ["BCRYPT_LOG_ROUNDS"] = "4"
+
+from sqlalchemy import select
+
+import streaming
+from app import app, db, User, Message, MESSAGE_COLUMNS, conversation_key, serialize_message
+
+
+def rss_mb():
+    # Current resident set size; fall back to the peak where /proc is missing
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def client_for(username):
+    client = app.test_client()
+    client.post("/register", json=dict(username=username, email=f"{username}@bench", password="pw", password_confirm="pw"))
+    response = client.post("/login", json=dict(email=f"{username}@bench", password="pw"))
+    assert response.status_code == 200, response.data
+    with app.app_context():
+        return client, User.query.filter_by(username=username).first().user_id
+
+
+def seed(sender_id, receiver_id, count):
+    start = datetime.datetime(2025, 1, 1)
+    conversation_id = conversation_key(sender_id, receiver_id)
+
+    def rows():
+        for i in range(count):
+            yield (
+                conversation_id,
+                sender_id if i % 2 else receiver_id,
+                receiver_id if i % 2 else sender_id,
+                f"{i:08d}" + "x" * 56,
+                (start + datetime.timedelta(seconds=i)).isoformat(" "),
+            )
+
+    connection = sqlite3.connect(DB_PATH)
+    with connection:
+        connection.executemany(
+            "INSERT INTO message (conversation_id, sender_id, receiver_id, encrypted_message, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)", rows()
+        )
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--buffered", action="store_true", help="also build the whole document in memory")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+    alice, alice_id = client_for("alice")
+    _, bob_id = client_for("bob")
+
+    started = time.perf_counter()
+    seed(alice_id, bob_id, args.messages)
+    print(f"seeded {args.messages} messages in {time.perf_counter() - started:.1f}s "
+          f"(JSON encoder: {'orjson' if streaming.orjson else 'json'})")
+
+    baseline = rss_mb()
+    print(f"RSS before download: {baseline:.1f} MB")
+
+    started = time.perf_counter()
+    response = alice.get(f"/export_messages/{bob_id}")
+    received, next_report, peak = 0, 0, baseline
+    for chunk in response.iter_encoded():
+        received += len(chunk)
+        if received >= next_report:
+            rss = rss_mb()
+            peak = max(peak, rss)
+            print(f"  {received / 2 ** 20:8.1f} MB sent, RSS {rss:.1f} MB")
+            next_report += 16 * 2 ** 20
+    response.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"streamed {received / 2 ** 20:.1f} MB in {elapsed:.1f}s, "
+          f"peak RSS {peak:.1f} MB (+{peak - baseline:.1f} MB over baseline)")
+
+    if args.buffered:
+        started = time.perf_counter()
+        with app.app_context():
+            query = select(*MESSAGE_COLUMNS).where(
+                Message.conversation_id == conversation_key(alice_id, bob_id)
+            ).order_by(Message.id.asc())
+            messages = [serialize_message(row) for row in db.session.execute(query)]
+            body = json.dumps({"messages": messages})
+            rss = rss_mb()
+            del messages, body
+        print(f"buffered: built the document in {time.perf_counter() - started:.1f}s, "
+              f"RSS {rss:.1f} MB (+{rss - baseline:.1f} MB over baseline)")
+
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Load test: seed a database, replay chat traffic against the app and report
+latency percentiles, throughput and SQL queries per endpoint.
+
+Usage (from the web/ directory):
+    python benchmarks/loadtest.py [--users 200] [--conversations 500] [--messages 20000]
+                                  [--active 50] [--duration 60] [--seed 1]
+                                  [--output results.json] [--compare baseline.json]
+
+By default the app is served in-process on a random localhost port against a
+throwaway SQLite database, and the SQL queries of every request are counted.
+To test another setup, point --database-url at its database (it is seeded
+there, so use an empty one). Add --url to send the traffic to a server you
+started yourself on that database; query counts are not available then.
+
+Every active user runs in its own thread and:
+    - logs in at the start, and again with probability --login-rate per second
+    - polls /get_messages?since=<cursor> for one of its conversations once per
+      second, sending If-None-Match like chat.js
+    - sends a burst of 1 to --burst messages with probability --send-rate per second
+    - calls /request_key for a random peer with probability --key-rate per second
+
+The JSON written by --output is stable between runs with the same options
+and seed, apart from the measurements, so results can be diffed between
+releases; --compare prints the change against an earlier result file.
+"""
+import argparse
+import datetime
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+PASSWORD = "loadtest-password"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="users to seed")
+    parser.add_argument("--conversations", type=int, default=500, help="user pairs with a message history")
+    parser.add_argument("--messages", type=int, default=20000, help="messages spread over the conversations")
+    parser.add_argument("--active", type=int, default=50, help="concurrently active users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of traffic")
+    parser.add_argument("--send-rate", type=float, default=0.1, help="message bursts per active user per second")
+    parser.add_argument("--burst", type=int, default=5, help="most messages in one burst")
+    parser.add_argument("--key-rate", type=float, default=0.02, help="/request_key calls per active user per second")
+    parser.add_argument("--login-rate", type=float, default=0.01, help="logins per active user per second")
+    parser.add_argument("--modulus-bits", type=int, default=1024, help="size of the seeded users' RSA keys")
+    parser.add_argument("--bcrypt-rounds", type=int, help="BCRYPT_LOG_ROUNDS for the in-process app")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the data set and the traffic")
+    parser.add_argument("--database-url", help="database to seed (default: a throwaway SQLite file)")
+    parser.add_argument("--url", help="base URL of a running server to test instead of the in-process app")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="earlier --output file to compare the results with")
+    return parser.parse_args()
+
+
+class Recorder:
+    """Latency samples and status codes per endpoint, from all client threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, seconds, status):
+        with self.lock:
+            self.latencies[endpoint].append(seconds * 1000)
+            self.statuses[endpoint][str(status)] += 1
+
+
+class QueryCounter:
+    """SQL statements and requests per Flask endpoint, counted inside the app."""
+
+    def __init__(self, app, engine):
+        from flask import has_request_context, request, request_started
+        from sqlalchemy import event
+
+        self.lock = threading.Lock()
+        self.queries = defaultdict(int)
+        self.requests = defaultdict(int)
+
+        def count_query(*args):
+            endpoint = request.endpoint if has_request_context() else "(background)"
+            with self.lock:
+                self.queries[endpoint] += 1
+
+        def count_request(sender, **extra):
+            with self.lock:
+                self.requests[request.endpoint] += 1
+
+        event.listen(engine, "before_cursor_execute", count_query)
+        request_started.connect(count_request, app, weak=False)
+
+    def per_request(self, endpoint):
+        with self.lock:
+            requests = self.requests.get(endpoint)
+            return round(self.queries.get(endpoint, 0) / requests, 2) if requests else None
+
+
+def seed(args, rng):
+    """Create the users, their keys and the message history, returns (users, peers)."""
+    from app import app, db, User, password_hasher, store_messages
+    from rsa import RSA
+
+    with app.app_context():
+        db.create_all()
+        if User.query.filter(User.email.like("%@loadtest")).first():
+            sys.exit("The database already holds load test users, use an empty one")
+
+        rsa = RSA()
+        password = password_hasher.generate_password_hash(PASSWORD)
+        users = []
+        started = time.perf_counter()
+        for i in range(args.users):
+            public_key, _ = rsa.generate_key_pair(args.modulus_bits // 2)
+            user = User(
+                user_id=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                username=f"load{i:05d}",
+                email=f"load{i:05d}@loadtest",
+                password=password,
+                public_key=json.dumps({"e": str(public_key[0]), "n": str(public_key[1])})
+            )
+            db.session.add(user)
+            users.append({"user_id": user.user_id, "email": user.email})
+        db.session.commit()
+        print(f"seeded {args.users} users in {time.perf_counter() - started:.1f}s")
+
+        pairs = set()
+        while len(pairs) < min(args.conversations, args.users * (args.users - 1) // 2):
+            a, b = rng.sample(range(args.users), 2)
+            pairs.add((min(a, b), max(a, b)))
+        pairs = sorted(pairs)
+
+        peers = defaultdict(list)
+        for a, b in pairs:
+            peers[a].append(b)
+            peers[b].append(a)
+
+        started = time.perf_counter()
+        timestamp = datetime.datetime(2025, 1, 1)
+        batch = []
+        for _ in range(args.messages if pairs else 0):
+            a, b = rng.choice(pairs)
+            if rng.random() < 0.5:
+                a, b = b, a
+            timestamp += datetime.timedelta(seconds=1)
+            batch.append({
+                "sender_id": users[a]["user_id"],
+                "receiver_id": users[b]["user_id"],
+                "encrypted_message": random_text(rng),
+                "timestamp": timestamp.isoformat()
+            })
+            if len(batch) == 1000:
+                store_messages(batch)
+                batch = []
+        if batch:
+            store_messages(batch)
+        print(f"seeded {args.messages} messages in {len(pairs)} conversations "
+              f"in {time.perf_counter() - started:.1f}s")
+
+    return users, peers
+
+
+def random_text(rng):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(8, 120)))
+
+
+class VirtualUser(threading.Thread):
+    """One logged-in browser: a cookie jar and the traffic of the chat page."""
+
+    def __init__(self, index, user, peers, users, args, base_url, recorder, deadline):
+        super().__init__(name=f"user-{index}", daemon=True)
+        self.user = user
+        self.peers = peers
+        self.users = users
+        self.args = args
+        self.base_url = base_url
+        self.recorder = recorder
+        self.deadline = deadline
+        self.rng = random.Random(f"{args.seed}-traffic-{index}")
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.cursors = {}
+        self.etags = {}
+
+    def call(self, endpoint, method, path, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers or {})
+        if data is not None:
+            request.add_header("Content-Type", "application/json")
+
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                status, payload, etag = response.status, response.read(), response.headers.get("ETag")
+        except urllib.error.HTTPError as error:
+            status, payload, etag = error.code, b"", error.headers.get("ETag")
+        except OSError as error:
+            status, payload, etag = type(error).__name__, b"", None
+        self.recorder.record(endpoint, time.perf_counter() - started, status)
+        return status, payload, etag
+
+    def login(self):
+        self.call("login", "POST", "/login", {"email": self.user["email"], "password": PASSWORD})
+
+    def poll(self, peer):
+        since = self.cursors.get(peer, 0)
+        path = f"/get_messages/{peer}?since={since}"
+        headers = {"If-None-Match": self.etags[path]} if path in self.etags else {}
+        status, payload, etag = self.call("get_messages", "GET", path, headers=headers)
+        if status == 200:
+            data = json.loads(payload)
+            self.cursors[peer] = data["cursor"]
+            self.etags = {path: etag} if etag else {}
+
+    def send_burst(self, peer):
+        for _ in range(self.rng.randint(1, self.args.burst)):
+            self.call("send_message", "POST", "/send_message", {
+                "receiver_id": peer, "encrypted_message": random_text(self.rng)
+            })
+
+    def request_key(self):
+        peer = self.rng.choice(self.users)["user_id"]
+        if peer != self.user["user_id"]:
+            self.call("request_key", "POST", "/request_key", {"user2_id": peer})
+
+    def run(self):
+        self.login()
+        peer = self.rng.choice(self.peers)
+
+        # Spread the users' ticks over the second instead of polling in lockstep
+        tick = time.perf_counter() + self.rng.random()
+        while True:
+            time.sleep(max(0, tick - time.perf_counter()))
+            if time.perf_counter() >= self.deadline:
+                return
+
+            if self.rng.random() < self.args.login_rate:
+                self.login()
+            if self.rng.random() < 0.05:
+                peer = self.rng.choice(self.peers)  # Switch to another open chat now and then
+            self.poll(peer)
+            if self.rng.random() < self.args.send_rate:
+                self.send_burst(peer)
+            if self.rng.random() < self.args.key_rate:
+                self.request_key()
+            tick += 1.0
+
+
+def serve_in_process(app):
+    import logging
+    from werkzeug.serving import make_server
+
+    # One access log line per request would drown the report
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def summarize(recorder, counter, elapsed):
+    endpoints = {}
+    for endpoint in sorted(recorder.latencies):
+        samples = recorder.latencies[endpoint]
+        statuses = dict(sorted(recorder.statuses[endpoint].items()))
+        errors = sum(n for status, n in statuses.items() if not (status.startswith("2") or status == "304"))
+        endpoints[endpoint] = {
+            "requests": len(samples),
+            "errors": errors,
+            "status": statuses,
+            "throughput_rps": round(len(samples) / elapsed, 2),
+            "latency_ms": {
+                "mean": round(statistics.mean(samples), 2),
+                "p50": round(percentile(samples, 50), 2),
+                "p95": round(percentile(samples, 95), 2),
+                "p99": round(percentile(samples, 99), 2),
+                "max": round(max(samples), 2),
+            },
+            "queries_per_request": counter.per_request(endpoint) if counter else None,
+        }
+    return endpoints
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_report(endpoints):
+    print(f"{'endpoint':<14} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'queries':>8}")
+    for endpoint, stats in endpoints.items():
+        latency = stats["latency_ms"]
+        queries = stats["queries_per_request"]
+        print(f"{endpoint:<14} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>8.1f} "
+              f"{latency['p50']:>8.1f} {latency['p95']:>8.1f} {latency['p99']:>8.1f} {latency['max']:>8.1f} "
+              f"{'-' if queries is None else queries:>8}")
+    print("latencies in ms, queries per request")
+
+
+def print_comparison(endpoints, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["endpoints"]
+
+    print(f"\nchange against {baseline_path}:")
+    print(f"{'endpoint':<14} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>9}")
+    for endpoint, stats in endpoints.items():
+        before = baseline.get(endpoint)
+        if not before:
+            print(f"{endpoint:<14} (new)")
+            continue
+
+        def change(new, old):
+            if new is None or old is None or old == 0:
+                return "-"
+            return f"{(new - old) / old * 100:+.0f}%"
+
+        print(f"{endpoint:<14} {change(stats['throughput_rps'], before['throughput_rps']):>9} "
+              + " ".join(f"{change(stats['latency_ms'][p], before['latency_ms'][p]):>9}" for p in ("p50", "p95", "p99"))
+              + f" {change(stats['queries_per_request'], before['queries_per_request']):>9}")
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    workdir = None
+    if not args.database_url:
+        workdir = tempfile.mkdtemp(prefix="keyforge-loadtest-")
+        args.database_url = f"sqlite:///{os.path.join(workdir, 'loadtest.sqlite3')}"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_LOG_ROUNDS"] = str(args.bcrypt_rounds)
+
+    from app import app, db
+    import streaming
+
+    try:
+        users, peers = seed(args, rng)
+
+        counter = None
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            with app.app_context():
+                counter = QueryCounter(app, db.engine)
+            server, base_url = serve_in_process(app)
+
+        active = rng.sample(range(len(users)), min(args.active, len(users)))
+        print(f"running {len(active)} active users against {base_url} for {args.duration:.0f}s")
+
+        recorder = Recorder()
+        started = time.perf_counter()
+        deadline = started + args.duration
+        threads = [
+            VirtualUser(n, users[i], [users[p]["user_id"] for p in peers[i]] or [users[(i + 1) % len(users)]["user_id"]],
+                        users, args, base_url, recorder, deadline)
+            for n, i in enumerate(active)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        endpoints = summarize(recorder, counter, elapsed)
+        print_report(endpoints)
+
+        with app.app_context():
+            dialect = db.engine.dialect.name
+        result = {
+            "benchmark": "loadtest",
+            "config": {key: value for key, value in sorted(vars(args).items())
+                       if key not in ("output", "compare", "database_url", "url")},
+            "environment": {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "database": dialect,
+                "server": "external" if args.url else "in-process",
+                "json_encoder": "orjson" if streaming.orjson else "json",
+            },
+            "elapsed_seconds": round(elapsed, 2),
+            "endpoints": endpoints,
+        }
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+                f.write("\n")
+            print(f"results written to {args.output}")
+        if args.compare:
+            print_comparison(endpoints, args.compare)
+
+        if not args.url:
+            server.shutdown()
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class PublicKeyCache:
+    """
+    Bounded LRU cache of parsed public keys, one entry per user id.
+    Each entry remembers the fingerprint of the key string it was parsed from,
+    so a key replaced behind the cache's back is re-parsed instead of served stale.
+    """
+
+    def __init__(self, parse, max_size=1024):
+        self.parse = parse
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, public_key):
+        """Return the parsed form of `public_key`, parsing it only on a miss."""
+        fingerprint = hashlib.sha256(public_key.encode('utf-8')).digest()
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        parsed = self.parse(public_key)
+
+        with self._lock:
+            self._entries[user_id] = (fingerprint, parsed)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return parsed
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache whose entries expire `ttl` seconds after they
+    were set. Holds at most `max_size` entries, dropping the oldest first.
+    """
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "ttl": self.ttl}
+
+
+class RedisTTLCache:
+    """
+    Same interface as `TTLCache`, backed by Redis so every worker process shares
+    entries and sees invalidations. Values must be JSON-serializable.
+    Requires the `redis` package.
+    """
+
+    def __init__(self, url, ttl, prefix="keyforge:"):
+        import redis  # Optional dependency, only needed for this cache
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._redis.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        self._redis.setex(self.prefix + key, self.ttl, json.dumps(value))
+
+    def delete(self, key):
+        self._redis.delete(self.prefix + key)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+def create_ttl_cache(url, ttl, prefix="keyforge:"):
+    """
+    Build a TTL cache from a URL:
+        - "memory://" (or empty): TTLCache, local to this process
+        - "redis://..." / "rediss://...": RedisTTLCache, shared between processes
+    """
+    if not url or url == "memory://":
+        return TTLCache(ttl)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisTTLCache(url, ttl, prefix=prefix)
+    raise ValueError(f"Unsupported cache URL: {url}")
@@ -0,0 +1,65 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HasherBusy(Exception):
+    """Raised when the password hashing queue is full and the request should be retried later."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and checking on a small, dedicated pool of worker threads.
+
+    bcrypt releases the GIL while it works, so the pool bounds how many cores
+    password hashing can take at once. At most `max_pending` operations may be
+    running or queued; beyond that `HasherBusy` is raised right away instead of
+    letting a login storm tie up every request thread.
+    """
+
+    def __init__(self, bcrypt, workers=2, max_pending=32):
+        self._bcrypt = bcrypt
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.metrics = {
+            op: {"count": 0, "rejected": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+            for op in ("hash", "check")
+        }
+
+    def generate_password_hash(self, password) -> str:
+        return self._run("hash", self._bcrypt.generate_password_hash, password).decode('utf-8')
+
+    def check_password_hash(self, pw_hash, password) -> bool:
+        return self._run("check", self._bcrypt.check_password_hash, pw_hash, password)
+
+    def stats(self):
+        with self._lock:
+            return {op: dict(values) for op, values in self.metrics.items()}
+
+    def _run(self, op, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.metrics[op]["rejected"] += 1
+            raise HasherBusy(f"Too many pending password {op} operations")
+
+        start = time.perf_counter()
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result()
+        finally:
+            # Latency as the caller sees it: time queued plus time hashing
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                metrics = self.metrics[op]
+                metrics["count"] += 1
+                metrics["total_seconds"] += elapsed
+                metrics["max_seconds"] = max(metrics["max_seconds"], elapsed)
@@ -0,0 +1,295 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    """Raised when the write-behind queue is full and the message should be retried later."""
+
+
+class JournalInUse(RuntimeError):
+    """Raised when another process already has the journal open."""
+
+
+class MessageJournal:
+    """
+    Append-only journal of accepted messages, one JSON record per line.
+
+    Appends are buffered writes; `sync` makes them durable. Concurrent callers
+    share fsyncs (group commit): whoever gets the sync lock first fsyncs every
+    record written so far, and the others find their record already covered.
+    A checkpoint file next to the journal stores the last sequence number that
+    reached the database, so recovery only replays what comes after it.
+
+    A journal belongs to one process: it is locked (through a .lock file next
+    to it) for as long as it is open, and opening it again elsewhere raises
+    JournalInUse. Two processes sharing it would truncate each other's
+    records and mix up their sequence numbers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock_file = self._lock(path + ".lock")
+        self._file = open(path, "a+", encoding="utf-8")
+        self._written = self.checkpoint()
+        self._synced = self._written
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def pending(self):
+        """Records appended after the checkpoint, i.e. not known to be in the database."""
+        checkpoint = self.checkpoint()
+        self._file.seek(0)
+        records = []
+        for line in self._file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # Torn write from a crash, nothing after it was acknowledged
+            if record["seq"] > checkpoint:
+                records.append(record)
+        if records:
+            self._written = self._synced = max(self._written, records[-1]["seq"])
+        return records
+
+    @property
+    def last_seq(self):
+        return self._written
+
+    def append(self, record):
+        """Assign the next sequence number to `record` and write it (not yet durable)."""
+        with self._write_lock:
+            self._written += 1
+            record["seq"] = self._written
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+        return record["seq"]
+
+    def sync(self, seq):
+        """Return once record `seq` is on disk."""
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._write_lock:
+                target = self._written
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    def checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def set_checkpoint(self, seq):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(seq))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def truncate_if(self, condition):
+        """Empty the journal if `condition()` holds while no append can run."""
+        with self._write_lock:
+            if condition():
+                self._file.truncate(0)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                return True
+        return False
+
+    def close(self):
+        self._file.close()
+        # Closing the lock file releases the lock
+        self._lock_file.close()
+
+    @staticmethod
+    def _lock(lock_path):
+        lock_file = open(lock_path, "a+", encoding="utf-8")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.seek(0)
+            owner = lock_file.read().strip() or "unknown"
+            lock_file.close()
+            raise JournalInUse(
+                f"Ingest journal {lock_path[:-len('.lock')]} is in use by another process (pid {owner}); "
+                "every process needs its own INGEST_JOURNAL_PATH"
+            ) from None
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        return lock_file
+
+
+class IngestQueue:
+    """
+    Write-behind ingestion for messages.
+
+    `submit` journals the message and returns once it is durable on disk; a
+    background writer then drains the bounded in-memory queue and hands batches
+    of up to `batch_size` records to `persist`, which must store them in one
+    transaction. On start, records journaled but not checkpointed by a previous
+    run are replayed through `persist(records, recovering=True)`.
+
+    Failures are retried with exponential backoff, capped at `max_retry_seconds`,
+    for as long as it takes: an unreachable or locked database only delays
+    messages. Only errors in `permanent_errors` (the data itself was rejected,
+    e.g. a constraint violation) are not retried; the batch is then stored
+    record by record, and the records that are rejected on their own are
+    appended to a dead-letter file next to the journal instead of blocking
+    the queue.
+    """
+
+    def __init__(self, journal_path, persist, max_size=10000, batch_size=500, retry_seconds=1.0,
+                 max_retry_seconds=30.0, permanent_errors=()):
+        self.persist = persist
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.permanent_errors = tuple(permanent_errors)
+        self.dead_letter_path = journal_path + ".dead"
+        self.accepted = 0
+        self.persisted = 0
+        self.dead_lettered = 0
+        self._journal = MessageJournal(journal_path)
+        self._queue = queue.Queue(maxsize=max_size)
+        self._persisted_seq = self._journal.checkpoint()
+        self._submit_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._writer = None
+
+    def start(self):
+        """Replay anything left over from the last run, then start the writer thread."""
+        leftover = self._journal.pending()
+        if leftover:
+            logger.info("Replaying %d journaled messages", len(leftover))
+            for i in range(0, len(leftover), self.batch_size):
+                self._persist(leftover[i:i + self.batch_size], recovering=True)
+        self._compact()
+
+        self._writer = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._writer.start()
+        return self
+
+    def submit(self, record):
+        """Durably accept one message record (a JSON-serializable dict)."""
+        # Producers are serialized here so the queue holds records in journal order,
+        # and checking for room first means a rejected record is never journaled
+        with self._submit_lock:
+            if self._queue.full():
+                raise IngestQueueFull("Message queue is full")
+            seq = self._journal.append(record)
+            self._queue.put_nowait(record)
+            self.accepted += 1
+
+        self._journal.sync(seq)
+        return record
+
+    def flush(self):
+        """Block until every accepted message has been persisted."""
+        self._queue.join()
+
+    def close(self):
+        """Persist everything still queued and stop the writer."""
+        if self._writer is None:
+            return
+        self.flush()
+        self._stopped.set()
+        self._writer.join()
+        self._writer = None
+        self._compact()
+        self._journal.close()
+
+    def stats(self):
+        return {
+            "accepted": self.accepted,
+            "persisted": self.persisted,
+            "queued": self._queue.qsize(),
+            "dead_lettered": self.dead_lettered,
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._persist(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if self._queue.empty():
+                self._compact()
+
+    def _persist(self, batch, recovering=False):
+        try:
+            self._store(batch, recovering)
+            stored = len(batch)
+        except self.permanent_errors:
+            # One bad record must not block the others: store them one by one
+            logger.exception("The database rejected a batch of %d messages, storing them one by one", len(batch))
+            stored = 0
+            for record in batch:
+                try:
+                    self._store([record], recovering)
+                    stored += 1
+                except self.permanent_errors:
+                    logger.exception("The database rejected message %d", record["seq"])
+                    self._dead_letter(record)
+
+        self.persisted += stored
+        self._persisted_seq = batch[-1]["seq"]
+        self._journal.set_checkpoint(self._persisted_seq)
+
+    def _store(self, records, recovering):
+        # Never drop acknowledged messages over an outage: retry until the database
+        # takes them, and only give up when it rejects the data itself
+        delay = self.retry_seconds
+        while True:
+            try:
+                self.persist(records, recovering=recovering)
+                return
+            except self.permanent_errors:
+                raise
+            except Exception:
+                logger.exception("Failed to persist %d messages, retrying in %.1fs", len(records), delay)
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_seconds)
+
+    def _dead_letter(self, record):
+        # Acknowledged messages are never dropped silently: keep them for inspection and replay
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_lettered += 1
+        logger.error("Message %d could not be stored, written to %s", record["seq"], self.dead_letter_path)
+
+    def _compact(self):
+        # Once the database has everything that was journaled, start an empty journal
+        self._journal.truncate_if(lambda: self._queue.empty() and self._journal.last_seq == self._persisted_seq)
@@ -0,0 +1,35 @@
+import secrets
+
+from rsa import RSA
+
+_rsa = RSA()
+
+
+def generate_session_key() -> str:
+    # A random Caesar shift between 1 and 26
+    return str(secrets.randbelow(26) + 1)
+
+
+def encrypt_session_key(public_key_1, public_key_2):
+    """
+    Generate a new Caesar session key and encrypt it for both users.
+    Public keys may be JSON strings or (e, n) tuples. Returns the two packed
+    ciphertexts, for the owner of `public_key_1` and of `public_key_2`.
+    Defined at module level so it can run in a process pool.
+    """
+    session_key = generate_session_key()
+    return (
+        _rsa.encrypt(session_key, public_key_1, packed=True),
+        _rsa.encrypt(session_key, public_key_2, packed=True),
+    )
+
+
+def encrypt_session_keys(pairs, executor=None, chunksize=8):
+    """
+    Run `encrypt_session_key` for every (public_key_1, public_key_2) pair,
+    spread over `executor` in chunks when one is given. Results keep the input order.
+    """
+    if executor is None or len(pairs) < 2:
+        return [encrypt_session_key(key_1, key_2) for key_1, key_2 in pairs]
+
+    return list(executor.map(encrypt_session_key, *zip(*pairs), chunksize=chunksize))
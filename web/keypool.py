@@ -0,0 +1,95 @@
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from rsa import RSA
+
+
+def _generate_prime(bits):
+    # Module level so it can be pickled into the worker processes
+    return RSA()._generate_large_prime(bits)
+
+
+class KeyPool:
+    """
+    Serves RSA key pairs in constant time from a bounded pool of pre-generated
+    pairs. A background thread keeps the pool full, and every pair is built by
+    searching for p and q in parallel in a process pool.
+
+    `key_size` has the same meaning as in `RSA.generate_key_pair`: the size of
+    each prime, so the modulus is twice as long.
+    """
+
+    def __init__(self, key_size=512, pool_size=8, workers=None):
+        self.key_size = key_size
+        self.pool_size = pool_size
+        self.hits = 0
+        self.misses = 0
+        self._rsa = RSA()
+        self._keys = queue.Queue(maxsize=pool_size)
+        # spawn, so workers do not inherit the refiller thread or locks it holds
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refiller = None
+
+    def start(self):
+        """Start the background worker that keeps the pool full."""
+        if self._refiller is None:
+            self._refiller = threading.Thread(target=self._refill, name="keypool-refill", daemon=True)
+            self._refiller.start()
+        return self
+
+    def get(self):
+        """
+        Return a fresh key pair, in the format of `RSA.generate_key_pair`.
+        Served from the pool when possible, generated on the spot otherwise.
+        """
+        try:
+            pair = self._keys.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.misses += 1
+            return self.generate()
+
+        with self._lock:
+            self.hits += 1
+        return pair
+
+    def generate(self):
+        """Generate one key pair, searching for p and q in parallel."""
+        p_future = self._executor.submit(_generate_prime, self.key_size)
+        q_future = self._executor.submit(_generate_prime, self.key_size)
+        p, q = p_future.result(), q_future.result()
+        while q == p:
+            q = self._executor.submit(_generate_prime, self.key_size).result()
+        return self._rsa.key_pair_from_primes(p, q)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "available": self._keys.qsize(),
+                "pool_size": self.pool_size,
+                "key_size": self.key_size,
+            }
+
+    def close(self):
+        """Stop the background worker and the process pool."""
+        self._stopped.set()
+        if self._refiller is not None:
+            self._refiller.join()
+            self._refiller = None
+        self._executor.shutdown(cancel_futures=True)
+
+    def _refill(self):
+        while not self._stopped.is_set():
+            pair = self.generate()
+            while not self._stopped.is_set():
+                try:
+                    self._keys.put(pair, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
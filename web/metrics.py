@@ -0,0 +1,336 @@
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A Prometheus counter with a fixed set of label names."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of label names."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(series)) for key, series in self._values.items())
+        samples = []
+        for key, series in values:
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-2] + [series[-2]]):
+                samples.append((self.name + "_bucket", key + (bound,), count))
+            samples.append((self.name + "_count", key, series[-2]))
+            samples.append((self.name + "_sum", key, series[-1]))
+        return samples
+
+
+class Registry:
+    """
+    Metrics of this process, rendered in the Prometheus text format.
+
+    Besides the metrics created here, collectors are called on every scrape and
+    return (name, type, help, [(labels dict, value), ...]) tuples, which is how
+    components that already keep their own statistics are exported.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, value in metric.samples():
+                names = metric.labels + ("le",) if name.endswith("_bucket") else metric.labels
+                lines.append(f"{name}{_format_labels(names, key)} {_format_value(value)}")
+
+        for collector in self._collectors:
+            for name, type, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of every thread that is serving a request, every
+    `interval` seconds, from one background thread. Stacks are kept folded
+    ("outer;inner;leaf" -> samples), the input format of flamegraph.pl and
+    speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def start(self, ident):
+        with self._lock:
+            self._active[ident] = collections.Counter()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._active.pop(ident, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[self._fold(frame)] += 1
+
+    @staticmethod
+    def _fold(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+
+class RequestState:
+    """What one request has done so far; lives on `flask.g` and in the close callback."""
+
+    __slots__ = ("endpoint", "method", "started", "sql_queries", "sql_seconds", "response_bytes")
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.started = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.response_bytes = 0
+
+
+class Metrics:
+    """
+    Request instrumentation for a Flask app:
+        - latency, SQL queries, SQL time and response size per endpoint
+        - SQL queries and time for work outside requests (e.g. background writers)
+        - `timed(operation)` for expensive operations such as RSA or bcrypt
+        - optionally, folded stacks of every request slower than `slow_request_seconds`,
+          written to `profile_dir`
+
+    Requests are measured until the server closes the response, so streamed
+    bodies count in full. Server-Sent Events streams are left out.
+    """
+
+    def __init__(self, registry=None, slow_request_seconds=None, profile_dir="profiles", profile_interval=0.005):
+        self.registry = registry or Registry()
+        self.slow_request_seconds = slow_request_seconds
+        self.profile_dir = profile_dir
+        self.profiler = SamplingProfiler(profile_interval) if slow_request_seconds else None
+
+        self.request_seconds = self.registry.histogram(
+            "keyforge_request_seconds", "Time from the start of a request until its response was closed",
+            ("endpoint", "method", "status"))
+        self.request_sql_queries = self.registry.histogram(
+            "keyforge_request_sql_queries", "SQL statements executed per request",
+            ("endpoint",), QUERY_COUNT_BUCKETS)
+        self.request_sql_seconds = self.registry.histogram(
+            "keyforge_request_sql_seconds", "Time spent executing SQL per request", ("endpoint",))
+        self.response_bytes = self.registry.histogram(
+            "keyforge_response_bytes", "Response body size", ("endpoint",), SIZE_BUCKETS)
+        self.sql_queries = self.registry.counter(
+            "keyforge_sql_queries_total", "SQL statements executed", ("endpoint",))
+        self.sql_seconds = self.registry.counter(
+            "keyforge_sql_seconds_total", "Time spent executing SQL", ("endpoint",))
+        self.operation_seconds = self.registry.histogram(
+            "keyforge_operation_seconds", "Duration of instrumented operations", ("operation",))
+        self.slow_requests = self.registry.counter(
+            "keyforge_slow_requests_total", "Requests slower than the profiling threshold", ("endpoint",))
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+        if self.profiler:
+            os.makedirs(self.profile_dir, exist_ok=True)
+
+    @contextmanager
+    def timed(self, operation):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.operation_seconds.observe(time.perf_counter() - started, operation=operation)
+
+    def render(self) -> str:
+        return self.registry.render()
+
+    def _before_request(self):
+        g.metrics = RequestState(request.endpoint or "unmatched", request.method)
+        if self.profiler:
+            self.profiler.start(threading.get_ident())
+
+    def _after_request(self, response):
+        state = g.get("metrics")
+        if state is None:
+            return response
+
+        if response.mimetype == "text/event-stream":
+            g.metrics = None
+            self._stop_profiler()
+            return response
+
+        if response.is_streamed:
+            response.response = self._count_bytes(response.response, state)
+        else:
+            state.response_bytes = response.content_length or 0
+
+        status = str(response.status_code)
+        ident = threading.get_ident()
+        response.call_on_close(lambda: self._finish(state, status, ident))
+        return response
+
+    def _finish(self, state, status, ident):
+        elapsed = time.perf_counter() - state.started
+        self.request_seconds.observe(elapsed, endpoint=state.endpoint, method=state.method, status=status)
+        self.request_sql_queries.observe(state.sql_queries, endpoint=state.endpoint)
+        self.request_sql_seconds.observe(state.sql_seconds, endpoint=state.endpoint)
+        self.response_bytes.observe(state.response_bytes, endpoint=state.endpoint)
+
+        stacks = self.profiler.stop(ident) if self.profiler else None
+        if stacks is not None and elapsed >= self.slow_request_seconds:
+            self.slow_requests.inc(endpoint=state.endpoint)
+            self._dump_profile(state, elapsed, stacks)
+
+    def _stop_profiler(self):
+        if self.profiler:
+            self.profiler.stop(threading.get_ident())
+
+    def _dump_profile(self, state, elapsed, stacks):
+        if not stacks:
+            # Finished before the first sample was taken
+            logger.warning("Slow request: %s %s took %.0f ms (%d SQL queries)",
+                           state.method, state.endpoint, elapsed * 1000, state.sql_queries)
+            return
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{state.endpoint}-{elapsed * 1000:.0f}ms-{threading.get_ident()}.folded"
+        path = os.path.join(self.profile_dir, name)
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, samples in stacks.most_common():
+                    f.write(f"{stack} {samples}\n")
+        except OSError:
+            logger.exception("Could not write the profile of a slow request")
+            return
+        logger.warning("Slow request: %s %s took %.0f ms (%d SQL queries), profile in %s",
+                       state.method, state.endpoint, elapsed * 1000, state.sql_queries, path)
+
+    @staticmethod
+    def _count_bytes(body, state):
+        try:
+            for chunk in body:
+                state.response_bytes += len(chunk)
+                yield chunk
+        finally:
+            # Closing the wrapped body lets stream_with_context pop its context
+            if hasattr(body, "close"):
+                body.close()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+
+        state = g.get("metrics") if has_app_context() else None
+        if state is not None:
+            state.sql_queries += 1
+            state.sql_seconds += elapsed
+            endpoint = state.endpoint
+        else:
+            endpoint = request.endpoint if has_request_context() else "(background)"
+        self.sql_queries.inc(endpoint=endpoint)
+        self.sql_seconds.inc(elapsed, endpoint=endpoint)
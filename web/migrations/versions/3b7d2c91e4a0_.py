@@ -0,0 +1,48 @@
+"""add conversation_id to message
+
+Revision ID: 3b7d2c91e4a0
+Revises: 6185d0c0ce9d
+Create Date: 2026-10-18 03:05:12.481907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7d2c91e4a0'
+down_revision = '6185d0c0ce9d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('conversation_id', sa.String(length=301), nullable=True))
+
+    # Backfill existing rows with the sorted "<lo>:<hi>" user pair
+    op.execute(
+        "UPDATE message SET conversation_id = CASE "
+        "WHEN sender_id < receiver_id THEN sender_id || ':' || receiver_id "
+        "ELSE receiver_id || ':' || sender_id END "
+        "WHERE sender_id IS NOT NULL AND receiver_id IS NOT NULL"
+    )
+    # Messages missing a user (sender_id and receiver_id are nullable) get an empty
+    # id in its place, so they are kept but never match a real user pair
+    op.execute(
+        "UPDATE message SET conversation_id = "
+        "COALESCE(sender_id, '') || ':' || COALESCE(receiver_id, '') "
+        "WHERE sender_id IS NULL OR receiver_id IS NULL"
+    )
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.alter_column('conversation_id',
+               existing_type=sa.String(length=301),
+               nullable=False)
+        batch_op.create_index('ix_message_conversation_id_id', ['conversation_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_conversation_id_id')
+        batch_op.drop_column('conversation_id')
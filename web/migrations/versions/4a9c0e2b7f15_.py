@@ -0,0 +1,32 @@
+"""user directory index and version counters
+
+Revision ID: 4a9c0e2b7f15
+Revises: e7a3f1c94d26
+Create Date: 2026-10-18 04:06:52.904113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a9c0e2b7f15'
+down_revision = 'e7a3f1c94d26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    counters = op.create_table('counters',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(counters, [{'name': 'users', 'value': 1}])
+
+    op.create_index('ix_users_username_lower', 'users', [sa.text('lower(username)'), 'username'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_username_lower', table_name='users')
+    op.drop_table('counters')
@@ -0,0 +1,41 @@
+"""store encrypted_keys as a unique sorted user pair
+
+Revision ID: 8f41a6d0c2b7
+Revises: 3b7d2c91e4a0
+Create Date: 2026-10-18 03:12:40.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f41a6d0c2b7'
+down_revision = '3b7d2c91e4a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Put every pair in canonical order (user1_id < user2_id), swapping the key halves with it
+    op.execute(
+        "UPDATE encrypted_keys SET "
+        "user1_id = user2_id, user2_id = user1_id, "
+        "encrypted_key_1 = encrypted_key_2, encrypted_key_2 = encrypted_key_1 "
+        "WHERE user1_id > user2_id"
+    )
+
+    # Keep only the newest row of any pair that was duplicated by concurrent requests
+    op.execute(
+        "DELETE FROM encrypted_keys WHERE id NOT IN ("
+        "SELECT max_id FROM (SELECT MAX(id) AS max_id FROM encrypted_keys GROUP BY user1_id, user2_id) AS newest"
+        ")"
+    )
+
+    with op.batch_alter_table('encrypted_keys', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_encrypted_keys_user_pair', ['user1_id', 'user2_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('encrypted_keys', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_encrypted_keys_user_pair', type_='unique')
@@ -0,0 +1,44 @@
+"""message archive segments
+
+Revision ID: b81d5e3a9c60
+Revises: 4a9c0e2b7f15
+Create Date: 2026-10-18 04:41:09.227741
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81d5e3a9c60'
+down_revision = '4a9c0e2b7f15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archive_segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('conversation_id', sa.String(length=301), nullable=False),
+    sa.Column('first_message_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(length=500), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('archive_segments', schema=None) as batch_op:
+        batch_op.create_index('ix_archive_segments_conversation_id_last_message_id', ['conversation_id', 'last_message_id'], unique=False)
+
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('archived_through', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_column('archived_through')
+
+    with op.batch_alter_table('archive_segments', schema=None) as batch_op:
+        batch_op.drop_index('ix_archive_segments_conversation_id_last_message_id')
+
+    op.drop_table('archive_segments')
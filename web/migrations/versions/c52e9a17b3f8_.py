@@ -0,0 +1,26 @@
+"""index encrypted_keys.user2_id
+
+Revision ID: c52e9a17b3f8
+Revises: 8f41a6d0c2b7
+Create Date: 2026-10-18 03:20:07.662914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e9a17b3f8'
+down_revision = '8f41a6d0c2b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('encrypted_keys', schema=None) as batch_op:
+        batch_op.create_index('ix_encrypted_keys_user2_id', ['user2_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('encrypted_keys', schema=None) as batch_op:
+        batch_op.drop_index('ix_encrypted_keys_user2_id')
@@ -0,0 +1,56 @@
+"""conversations summary table
+
+Revision ID: e7a3f1c94d26
+Revises: c52e9a17b3f8
+Create Date: 2026-10-18 03:48:21.530417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a3f1c94d26'
+down_revision = 'c52e9a17b3f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversations',
+    sa.Column('id', sa.String(length=301), nullable=False),
+    sa.Column('user1_id', sa.String(length=150), nullable=False),
+    sa.Column('user2_id', sa.String(length=150), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_at', sa.DateTime(), nullable=False),
+    sa.Column('unread_1', sa.Integer(), nullable=False),
+    sa.Column('unread_2', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user1_id'], ['users.user_id'], ),
+    sa.ForeignKeyConstraint(['user2_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.create_index('ix_conversations_user1_id', ['user1_id'], unique=False)
+        batch_op.create_index('ix_conversations_user2_id', ['user2_id'], unique=False)
+
+    # One row per existing conversation, pointing at its newest message.
+    # Read state was never tracked before, so everything starts as read.
+    op.execute(
+        "INSERT INTO conversations (id, user1_id, user2_id, last_message_id, last_message_at, unread_1, unread_2) "
+        "SELECT m.conversation_id, "
+        "CASE WHEN m.sender_id < m.receiver_id THEN m.sender_id ELSE m.receiver_id END, "
+        "CASE WHEN m.sender_id < m.receiver_id THEN m.receiver_id ELSE m.sender_id END, "
+        "m.id, COALESCE(m.timestamp, CURRENT_TIMESTAMP), 0, 0 "
+        "FROM message m JOIN ("
+        "SELECT MAX(id) AS max_id FROM message GROUP BY conversation_id"
+        ") AS newest ON m.id = newest.max_id "
+        "WHERE m.sender_id IS NOT NULL AND m.receiver_id IS NOT NULL"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversations_user2_id')
+        batch_op.drop_index('ix_conversations_user1_id')
+
+    op.drop_table('conversations')
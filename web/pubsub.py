@@ -0,0 +1,121 @@
+import json
+import queue
+import threading
+
+
+class Subscription:
+    """
+    A single listener on a channel. Events are buffered in a bounded queue;
+    if the listener falls too far behind it is closed so the client can
+    reconnect and resync instead of silently missing events.
+    """
+
+    def __init__(self, hub, channel, max_queue):
+        self.hub = hub
+        self.channel = channel
+        self.closed = False
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    def put(self, payload):
+        try:
+            self._queue.put_nowait(payload)
+        except queue.Full:
+            self.close()
+
+    def get(self, timeout=None):
+        """Return the next event, or None if nothing arrived within `timeout` seconds."""
+        if self.closed:
+            return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.hub._unsubscribe(self)
+
+
+class InProcessHub:
+    """
+    Publish/subscribe hub that only delivers events inside the current process.
+    Good enough for a single worker and used as the local stand-in for tests.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def publish(self, channel, payload):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(payload)
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+class RedisSubscription:
+    def __init__(self, pubsub, channel):
+        self.channel = channel
+        self.closed = False
+        self._pubsub = pubsub
+        self._pubsub.subscribe(channel)
+
+    def get(self, timeout=None):
+        if self.closed:
+            return None
+        message = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message is None:
+            return None
+        return json.loads(message["data"])
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._pubsub.close()
+
+
+class RedisHub:
+    """
+    Publish/subscribe hub backed by Redis, so events reach subscribers
+    connected to any worker process. Requires the `redis` package.
+    """
+
+    def __init__(self, url):
+        import redis  # Optional dependency, only needed for this hub
+
+        self._redis = redis.Redis.from_url(url)
+
+    def subscribe(self, channel):
+        return RedisSubscription(self._redis.pubsub(), channel)
+
+    def publish(self, channel, payload):
+        self._redis.publish(channel, json.dumps(payload))
+
+
+def create_hub(url=None):
+    """
+    Build a hub from a broker URL:
+        - "memory://" (or empty): InProcessHub
+        - "redis://..." / "rediss://...": RedisHub
+    """
+    if not url or url == "memory://":
+        return InProcessHub()
+    if url.startswith(("redis://", "rediss://")):
+        return RedisHub(url)
+    raise ValueError(f"Unsupported events broker URL: {url}")
@@ -1,11 +1,42 @@
 import random
 import json
+import base64
+import secrets
 from math import gcd
 
+# Version tag of the packed ciphertext format. Ciphertexts without it are the
+# legacy comma separated list of one number per character.
+PACKED_PREFIX = "rsa2:"
+
+# Bytes of PKCS#1 v1.5 padding overhead per block: 0x00 0x02, at least 8 random
+# non-zero bytes, then a 0x00 separator before the message
+PACKED_OVERHEAD = 11
+
+# Number of consecutive odd candidates sieved per random starting point
+SIEVE_WINDOW = 4096
+
+
+def _odd_primes_below(limit):
+    sieve = bytearray([1]) * limit
+    sieve[:2] = b"\x00\x00"
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytes(len(range(i * i, limit, i)))
+    return [i for i in range(3, limit) if sieve[i]]
+
+# Small primes used to throw out most candidates before any modular exponentiation
+SMALL_PRIMES = _odd_primes_below(2000)
+
+
 class RSA:
     def generate_key_pair(self, key_size=512):
         p = self._generate_large_prime(key_size)
         q = self._generate_large_prime(key_size)
+        while q == p:
+            q = self._generate_large_prime(key_size)
+        return self.key_pair_from_primes(p, q)
+
+    def key_pair_from_primes(self, p, q):
         n = p * q
         phi = (p - 1) * (q - 1)
 
@@ -14,34 +45,143 @@ class RSA:
             e = random.randrange(3, phi, 2)
 
         d = pow(e, -1, phi)
-        return ((e, n), (d, n))
 
-    def encrypt(self, plaintext: str, public_key: str) -> str:
+        # CRT parameters, they let decrypt work modulo p and q separately
+        dp = d % (p - 1)
+        dq = d % (q - 1)
+        qinv = pow(q, -1, p)
+        return ((e, n), (d, n, p, q, dp, dq, qinv))
+
+    def parse_public_key(self, public_key: str):
         key_data = json.loads(public_key)  # public_key is a JSON string like '{"e": "...", "n": "..."}'
-        e = int(key_data["e"])
-        n = int(key_data["n"])
+        return (int(key_data["e"]), int(key_data["n"]))
+
+    def encrypt(self, plaintext: str, public_key, packed: bool = False) -> str:
+        # public_key is either the stored JSON string or an (e, n) tuple from parse_public_key
+        e, n = self.parse_public_key(public_key) if isinstance(public_key, str) else public_key
+        if packed:
+            return self._encrypt_packed(plaintext.encode('utf-8'), e, n)
         cipher = [pow(ord(char), e, n) for char in plaintext]
         return ','.join(map(str, cipher))
 
 
     def decrypt(self, ciphertext: str, private_key: str) -> str:
-        key_data = json.loads(private_key)  # public_key is a JSON string like '{"e": "...", "n": "..."}'
+        # private_key is a JSON string like '{"d": "...", "n": "..."}', newer keys
+        # also carry the CRT parameters "p", "q", "dp", "dq" and "qinv"
+        key_data = json.loads(private_key)
+        power = self._private_pow(key_data)
+
+        if ciphertext.startswith(PACKED_PREFIX):
+            return self._decrypt_packed(ciphertext[len(PACKED_PREFIX):], power, int(key_data["n"]))
+
+        numbers = list(map(int, ciphertext.split(',')))
+        return ''.join([chr(power(c)) for c in numbers])
+
+    def _encrypt_packed(self, data: bytes, e, n) -> str:
+        # Split the UTF-8 bytes into modulus-sized blocks, pad each one
+        # PKCS#1 v1.5 style and concatenate the fixed-width ciphertexts
+        k = (n.bit_length() + 7) // 8
+        chunk_size = k - PACKED_OVERHEAD
+        if chunk_size < 1:
+            raise ValueError("Modulus is too small for packed encryption")
+
+        out = bytearray()
+        for i in range(0, max(len(data), 1), chunk_size):
+            chunk = data[i:i + chunk_size]
+            padding = bytes(secrets.randbelow(255) + 1 for _ in range(k - 3 - len(chunk)))
+            block = int.from_bytes(b"\x00\x02" + padding + b"\x00" + chunk, 'big')
+            out += pow(block, e, n).to_bytes(k, 'big')
+        return PACKED_PREFIX + base64.b64encode(bytes(out)).decode('ascii')
+
+    def _decrypt_packed(self, payload: str, power, n) -> str:
+        k = (n.bit_length() + 7) // 8
+        raw = base64.b64decode(payload)
+        if not raw or len(raw) % k:
+            raise ValueError("Packed ciphertext length does not match the key size")
+
+        data = bytearray()
+        for i in range(0, len(raw), k):
+            block = power(int.from_bytes(raw[i:i + k], 'big')).to_bytes(k, 'big')
+            separator = block.find(b"\x00", 2)
+            if block[:2] != b"\x00\x02" or separator < 10:
+                raise ValueError("Invalid padding in packed ciphertext")
+            data += block[separator + 1:]
+        return data.decode('utf-8')
+
+    def _private_pow(self, key_data):
+        # Returns c -> c^d mod n, using CRT when the key has the parameters for it
+        if all(k in key_data for k in ("p", "q", "dp", "dq", "qinv")):
+            p, q, dp, dq, qinv = (int(key_data[k]) for k in ("p", "q", "dp", "dq", "qinv"))
+            return lambda c: self._crt_pow(c, p, q, dp, dq, qinv)
+
         d = int(key_data["d"])
         n = int(key_data["n"])
-        numbers = list(map(int, ciphertext.split(',')))
-        return ''.join([chr(pow(c, d, n)) for c in numbers])
+        return lambda c: pow(c, d, n)
+
+    def _crt_pow(self, c, p, q, dp, dq, qinv):
+        # Two half-size exponentiations recombined with Garner's formula,
+        # same result as pow(c, d, p * q) at roughly a third of the cost
+        m1 = pow(c, dp, p)
+        m2 = pow(c, dq, q)
+        h = (qinv * (m1 - m2)) % p
+        return m2 + h * q
 
 
     def _generate_large_prime(self, bits):
+        if bits < 16:
+            raise ValueError("Primes must be at least 16 bits")
+
         while True:
-            p = random.getrandbits(bits)
-            if self._is_prime(p):
-                return p
+            # Random odd starting point with the top two bits set, so p * q has the full key size
+            base = secrets.randbits(bits) | (3 << (bits - 2)) | 1
+
+            # Sieve the window base, base + 2, base + 4, ... against the small primes:
+            # composite[i] is set when base + 2 * i has a small factor
+            composite = bytearray(SIEVE_WINDOW)
+            for prime in SMALL_PRIMES:
+                # First i with (base + 2 * i) % prime == 0; (prime + 1) // 2 is the inverse of 2
+                start = (-base % prime) * ((prime + 1) // 2) % prime
+                composite[start::prime] = b"\x01" * len(range(start, SIEVE_WINDOW, prime))
+
+            # Incremental search: only the survivors get a Miller-Rabin test
+            for i in range(SIEVE_WINDOW):
+                candidate = base + 2 * i
+                if candidate.bit_length() > bits:
+                    break
+                if not composite[i] and self._is_prime(candidate, self._miller_rabin_rounds(bits)):
+                    return candidate
+
+    def _miller_rabin_rounds(self, bits):
+        # Rounds keeping the error below 2^-100 for random candidates (FIPS 186-4, table C.3)
+        if bits >= 1536:
+            return 3
+        if bits >= 1024:
+            return 4
+        if bits >= 512:
+            return 7
+        return 20
 
     def _is_prime(self, n, k=5):
+        # Miller-Rabin with k random bases
         if n < 2: return False
+        if n in (2, 3): return True
+        if n % 2 == 0: return False
+
+        # Write n - 1 as 2^s * d with d odd
+        d, s = n - 1, 0
+        while d % 2 == 0:
+            d //= 2
+            s += 1
+
         for _ in range(k):
-            a = random.randint(2, n - 2)
-            if pow(a, n - 1, n) != 1:
+            a = secrets.randbelow(n - 3) + 2
+            x = pow(a, d, n)
+            if x == 1 or x == n - 1:
+                continue
+            for _ in range(s - 1):
+                x = pow(x, 2, n)
+                if x == n - 1:
+                    break
+            else:
                 return False
         return True
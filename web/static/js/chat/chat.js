@@ -1,6 +1,9 @@
 let currentContact = null;
 let contactCaesarKeys = {}; 
 let refreshInterval = null;
+let eventSource = null;
+let pushConnected = false;
+let contactButtons = {};
 
 document.addEventListener("DOMContentLoaded", () => {
     const privateKey = JSON.parse(localStorage.getItem("private_key"));
@@ -9,8 +12,7 @@ document.addEventListener("DOMContentLoaded", () => {
         return;
     }
 
-    const d = BigInt(privateKey.d);
-    const n = BigInt(privateKey.n);
+    const key = parsePrivateKey(privateKey);
 
     fetch("/mykeys", {
         method: "POST",
@@ -23,9 +25,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
         data.keys.forEach(({ user_id, username, encrypted_key }) => {
             // Decrypt our caesar key
-            const cipherArray = encrypted_key.split(",").map(num => BigInt(num));
-            const decryptedArray = cipherArray.map(c => modPow(c, d, n));
-            const caesarKey = parseInt(decryptedArray.map(c => String.fromCharCode(Number(c))).join(''));
+            const caesarKey = parseInt(rsaDecrypt(encrypted_key, key));
 
 
             // Save in the memory
@@ -34,67 +34,271 @@ document.addEventListener("DOMContentLoaded", () => {
             // Add to our contact list
             const contactBtn = document.createElement("button");
             contactBtn.className = "block w-full text-left p-2 rounded bg-gray-700 hover:bg-gray-600";
-            contactBtn.innerText = `💬 ${username}`;
+            contactBtn.innerHTML = `
+                <div class="flex justify-between items-center">
+                    <span class="unread bg-blue-600 rounded px-2 text-sm hidden"></span>
+                </div>
+                <div class="preview text-sm text-gray-400"></div>
+            `;
+            // Usernames are user input: set as text, never parsed as HTML
+            const name = document.createElement("span");
+            name.innerText = `💬 ${username}`;
+            contactBtn.firstElementChild.prepend(name);
             contactBtn.onclick = () => openChat(user_id, username);
             contactsList.appendChild(contactBtn);
+            contactButtons[user_id] = { button: contactBtn, unread: 0 };
         });
+
+        loadConversations();
     });
+
+    connectEvents();
 });
 
+// Subscribe to pushed messages. Polling is only used while this is down.
+function connectEvents() {
+    if (!window.EventSource) return;
+
+    eventSource = new EventSource("/events");
+
+    eventSource.onopen = () => {
+        pushConnected = true;
+        stopPolling();
+        // Pick up anything sent while we were disconnected
+        loadMessages();
+    };
+
+    eventSource.onerror = () => {
+        // The browser reconnects on its own; poll until it does
+        pushConnected = false;
+        startPolling();
+    };
+
+    eventSource.addEventListener("message", event => {
+        const msg = JSON.parse(event.data);
+        const contact = currentContact;
+        const open = contact && (msg.sender_id === contact.userId || msg.receiver_id === contact.userId);
+
+        // Keep the contact list in step: preview, and a badge unless the chat is open
+        const peerId = contactButtons[msg.sender_id] ? msg.sender_id : msg.receiver_id;
+        showPreview(peerId, msg);
+        if (msg.sender_id === peerId) {
+            if (open) markRead(peerId);
+            else setUnread(peerId, contactButtons[peerId].unread + 1);
+        }
+
+        if (open) showMessages([msg], contact);
+    });
+}
+
+// Unread counters and last messages for every contact, in one request
+function loadConversations() {
+    fetch("/api/conversations")
+        .then(res => res.json())
+        .then(data => {
+            const contactsList = document.getElementById("contactsList");
+
+            // Most recent conversations first, contacts we never wrote to stay below
+            data.conversations.slice().reverse().forEach(conversation => {
+                const entry = contactButtons[conversation.user_id];
+                if (!entry) return;
+                contactsList.prepend(entry.button);
+                showPreview(conversation.user_id, conversation.last_message);
+                if (currentContact && currentContact.userId === conversation.user_id) {
+                    if (conversation.unread) markRead(conversation.user_id);
+                } else {
+                    setUnread(conversation.user_id, conversation.unread);
+                }
+            });
+        })
+        .catch(err => console.error("Failed to fetch conversations:", err));
+}
+
+function setUnread(userId, count) {
+    const entry = contactButtons[userId];
+    if (!entry) return;
+    entry.unread = count;
+
+    const badge = entry.button.querySelector(".unread");
+    badge.innerText = count;
+    badge.classList.toggle("hidden", count === 0);
+}
+
+function showPreview(userId, msg) {
+    const entry = contactButtons[userId];
+    const key = contactCaesarKeys[userId];
+    if (!entry || key === undefined) return;
+
+    const prefix = msg.sender_id === userId ? "" : "You: ";
+    entry.button.querySelector(".preview").innerText = prefix + caesarDecrypt(msg.encrypted_message, key);
+}
+
+function markRead(userId) {
+    setUnread(userId, 0);
+    fetch(`/api/conversations/${userId}/read`, { method: "POST" })
+        .catch(err => console.error("Failed to mark conversation as read:", err));
+}
+
+function startPolling() {
+    if (!refreshInterval && currentContact) {
+        refreshInterval = setInterval(loadMessages, 1000);
+    }
+}
+
+function stopPolling() {
+    if (refreshInterval) clearInterval(refreshInterval);
+    refreshInterval = null;
+}
+
 function openChat(userId, username) {
-    currentContact = { userId, username };
+    currentContact = { userId, username, cursor: 0, seen: new Set(), ready: false, before: null, hasMore: false };
     document.getElementById("chatWith").innerText = username;
+    document.getElementById("chatBox").innerHTML = "";
+    if (contactButtons[userId] && contactButtons[userId].unread) markRead(userId);
 
-    // Clear previous interval if exists
-    if (refreshInterval) clearInterval(refreshInterval);
+    // Load the newest page of history, then rely on pushed events
+    // and fall back to polling every second without them
+    stopPolling();
+    loadHistory(currentContact);
+    if (!pushConnected) startPolling();
+}
+
+// Load one page of history, newest first. Without `contact.before`
+// this is the first page and also sets the cursor we poll from.
+function loadHistory(contact) {
+    if (contact.loadingHistory) return;
+    contact.loadingHistory = true;
 
-    // Fetch messages immediately and then every second
-    loadMessages();
-    refreshInterval = setInterval(loadMessages, 1000);
+    const params = contact.before ? `?before=${contact.before}` : "";
 
-    // Fetch and display messages
-    function loadMessages() {
-        fetch(`/get_messages/${userId}`)
-            .then(res => res.json())
-            .then(messages => {
-                const chatBox = document.getElementById("chatBox");
-                chatBox.innerHTML = "";
+    fetch(`/get_messages/${contact.userId}${params}`)
+        .then(res => res.json())
+        .then(data => {
+            contact.loadingHistory = false;
+            if (contact !== currentContact) return;
 
-                const myKey = contactCaesarKeys[userId];
+            const chatBox = document.getElementById("chatBox");
+            const firstPage = !contact.ready;
+            const previousHeight = chatBox.scrollHeight;
 
-                messages.forEach(msg => {
-                    const isSender = msg.sender_id === currentContact.userId;
-                    const senderName = isSender ? username : "You";
-                    const decryptedText = caesarDecrypt(msg.encrypted_message, myKey);
+            renderMessages(data.messages, contact);
+            contact.hasMore = data.has_more;
+            if (data.before) contact.before = data.before;
 
-                    // Format timestamp
-                    const time = new Date(msg.timestamp);
-                    const formattedTime = time.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+            if (firstPage) {
+                contact.cursor = data.cursor;
+                contact.ready = true;
+                chatBox.scrollTop = chatBox.scrollHeight;
+                // Catch up on anything sent while the page was loading
+                loadMessages();
+            } else {
+                // Keep the messages the user was reading in place
+                chatBox.scrollTop += chatBox.scrollHeight - previousHeight;
+            }
 
-                    // Create message element
-                    const messageDiv = document.createElement("div");
-                    messageDiv.className = isSender ? "text-left mb-2" : "text-right mb-2";
+            // Keep going until the box can scroll, otherwise we never see a scroll event
+            if (contact.hasMore && chatBox.scrollHeight <= chatBox.clientHeight) loadHistory(contact);
+        })
+        .catch(err => {
+            contact.loadingHistory = false;
+            console.error("Failed to fetch message history:", err);
+        });
+}
 
-                    const bubble = document.createElement("div");
-                    bubble.className = isSender
-                        ? "inline-block bg-gray-700 text-white px-4 py-2 rounded-lg max-w-xs"
-                        : "inline-block bg-blue-600 text-white px-4 py-2 rounded-lg max-w-xs";
+// Fetch only the messages newer than our cursor and append them
+function loadMessages() {
+    const contact = currentContact;
+    if (!contact || !contact.ready || contact.loading) return;
+    contact.loading = true;
 
-                    bubble.innerHTML = `
-                        <div class="text-lg">${decryptedText}</div>
-                        <div class="text-sm text-gray-300 mt-1">${senderName} • ${formattedTime}</div>
-                    `;
+    // Send back the ETag of the last identical poll: while nothing is new
+    // the server answers 304 without reading any messages
+    const url = `/get_messages/${contact.userId}?since=${contact.cursor}`;
+    const headers = contact.poll && contact.poll.url === url ? { "If-None-Match": contact.poll.etag } : {};
 
-                    messageDiv.appendChild(bubble);
-                    chatBox.appendChild(messageDiv);
-                });
+    fetch(url, { headers, cache: "no-store" })
+        .then(res => {
+            if (res.status === 304) return null;
+            contact.poll = { url, etag: res.headers.get("ETag") };
+            return res.json();
+        })
+        .then(data => {
+            contact.loading = false;
 
-                chatBox.scrollTop = chatBox.scrollHeight;
-            })
-            .catch(err => {
-                console.error("Failed to fetch messages:", err);
-            });
+            // Nothing new, or the user switched to another chat while we were waiting
+            if (!data || contact !== currentContact) return;
+
+            showMessages(data.messages, contact);
+            contact.cursor = Math.max(contact.cursor, data.cursor);
+
+            // Catch up right away if the server has more waiting for us
+            if (data.has_more) loadMessages();
+        })
+        .catch(err => {
+            contact.loading = false;
+            console.error("Failed to fetch messages:", err);
+        });
+}
+
+// Show new messages at the bottom of the chat box. Pushed and polled
+// messages can overlap or arrive out of order, so they are de-duplicated
+// by id and only the polled `cursor` is trusted to resume from.
+function showMessages(messages, contact) {
+    if (!renderMessages(messages, contact)) return;
+
+    const chatBox = document.getElementById("chatBox");
+    chatBox.scrollTop = chatBox.scrollHeight;
+}
+
+// Render the messages we have not displayed yet, returns how many were added
+function renderMessages(messages, contact) {
+    const fresh = messages.filter(msg => !contact.seen.has(msg.id));
+    fresh.forEach(msg => {
+        contact.seen.add(msg.id);
+        appendMessage(msg, contact);
+    });
+    return fresh.length;
+}
+
+// Render a single message, keeping the chat box ordered by message id
+function appendMessage(msg, contact) {
+    const chatBox = document.getElementById("chatBox");
+    const myKey = contactCaesarKeys[contact.userId];
+
+    const isSender = msg.sender_id === contact.userId;
+    const senderName = isSender ? contact.username : "You";
+    const decryptedText = caesarDecrypt(msg.encrypted_message, myKey);
+
+    // Format timestamp
+    const time = new Date(msg.timestamp);
+    const formattedTime = time.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+
+    // Create message element
+    const messageDiv = document.createElement("div");
+    messageDiv.className = isSender ? "text-left mb-2" : "text-right mb-2";
+
+    const bubble = document.createElement("div");
+    bubble.className = isSender
+        ? "inline-block bg-gray-700 text-white px-4 py-2 rounded-lg max-w-xs"
+        : "inline-block bg-blue-600 text-white px-4 py-2 rounded-lg max-w-xs";
+
+    bubble.innerHTML = `
+        <div class="text-lg">${decryptedText}</div>
+        <div class="text-sm text-gray-300 mt-1">${senderName} • ${formattedTime}</div>
+    `;
+
+    messageDiv.appendChild(bubble);
+    messageDiv.dataset.id = msg.id;
+
+    // New messages go to the bottom, older history pages walk in from the top
+    const last = chatBox.lastElementChild;
+    if (!last || Number(last.dataset.id) < msg.id) {
+        chatBox.appendChild(messageDiv);
+        return;
     }
+    let next = chatBox.firstElementChild;
+    while (next && Number(next.dataset.id) < msg.id) next = next.nextElementSibling;
+    chatBox.insertBefore(messageDiv, next);
 }
 
 
@@ -115,7 +319,8 @@ function sendMessage() {
         })
     }).then(() => {
         input.value = "";
-        openChat(currentContact.userId, currentContact.username);
+        // The pushed event shows the message; only fetch it ourselves without push
+        if (!pushConnected) loadMessages();
     });
 }
 
@@ -127,21 +332,17 @@ function caesarDecrypt(text, key) {
     return text.split('').map(c => String.fromCharCode(c.charCodeAt(0) - key)).join('');
 }
 
-// Compute mod
-function modPow(base, exp, mod) {
-    base %= mod;
-    let result = 1n;
-    while (exp > 0n) {
-        if (exp % 2n === 1n) result = (result * base) % mod;
-        base = (base * base) % mod;
-        exp >>= 1n;
-    }
-    return result;
-}
-
-
 document.addEventListener('DOMContentLoaded', () => {
     const messageInput = document.getElementById('messageInput');
+    const chatBox = document.getElementById('chatBox');
+
+    // Infinite scroll: load older messages when the user reaches the top
+    chatBox.addEventListener('scroll', () => {
+        const contact = currentContact;
+        if (contact && contact.ready && contact.hasMore && chatBox.scrollTop < 50) {
+            loadHistory(contact);
+        }
+    });
 
     messageInput.addEventListener('keydown', (event) => {
         if (event.key === 'Enter' && !event.shiftKey) {
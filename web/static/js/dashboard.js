@@ -1,20 +1,51 @@
 let privateKey = null;
+let shownUsers = [];
 
-async function fetchUsers() {
-    const res = await fetch('/api/users');
-    const data = await res.json();
-    return data.users;
+let nextCursor = null;
+let searchTimer = null;
+let searchQuery = '';
+
+// One page of users whose name starts with `query`, after the `after` cursor.
+// The server answers 304 when the directory has not changed, the browser
+// then reuses its cached copy.
+async function fetchUsers(query, after) {
+    const params = new URLSearchParams({ q: query });
+    if (after) params.set('after', after);
+    const res = await fetch(`/api/users?${params}`);
+    return res.json();
 }
 
-document.getElementById('searchUser').addEventListener('input', async function () {
-    const query = this.value.toLowerCase();
-    const users = await fetchUsers();
+document.getElementById('searchUser').addEventListener('input', function () {
+    // Wait for the user to stop typing before asking the server
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => searchUsers(this.value.trim()), 200);
+});
+
+async function searchUsers(query) {
+    searchQuery = query;
+    const data = await fetchUsers(query);
+    if (query !== searchQuery) return;  // A newer search has started
+
+    shownUsers = [];
+    document.getElementById('userResults').innerHTML = '';
+    showUsers(data);
+}
 
-    const filtered = users.filter(u => u.username.toLowerCase().includes(query));
+async function loadMoreUsers() {
+    const query = searchQuery;
+    const data = await fetchUsers(query, nextCursor);
+    if (query !== searchQuery) return;
+    showUsers(data);
+}
+
+function showUsers(data) {
     const ul = document.getElementById('userResults');
-    ul.innerHTML = '';
+    shownUsers = shownUsers.concat(data.users);
+    nextCursor = data.next;
+    document.getElementById('requestAllKeys').classList.toggle('hidden', shownUsers.length < 2);
+    document.getElementById('loadMoreUsers').classList.toggle('hidden', !nextCursor);
 
-    filtered.forEach(user => {
+    data.users.forEach(user => {
         const li = document.createElement('li');
         li.innerHTML = `
             <div class="p-2 bg-gray-800 rounded flex justify-between items-center">
@@ -23,7 +54,7 @@ document.getElementById('searchUser').addEventListener('input', async function (
             </div>`;
         ul.appendChild(li);
     });
-});
+}
 
 
 
@@ -40,3 +71,24 @@ function requestKey(user2_id) {
         alert("Encrypted Caesar key received and stored.");
     });
 }
+
+// Establish keys with every user in the results in a single request
+function requestAllKeys() {
+    fetch('/request_keys', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            user2_ids: shownUsers.map(u => u.user_id)
+        })
+    })
+    .then(res => res.json())
+    .then(data => {
+        if (data.error) {
+            alert(data.error);
+            return;
+        }
+        const failed = Object.keys(data.errors).length;
+        alert(`Encrypted Caesar keys received for ${Object.keys(data.keys).length} users.` +
+              (failed ? ` ${failed} could not be set up.` : ''));
+    });
+}
@@ -45,26 +45,6 @@ function decryptRSA(encryptedKey) {
         return "Error: Missing private key";
     }
 
-    // Convert the private key components from strings to BigInt
-    const d = BigInt(privateKey.d);
-    const n = BigInt(privateKey.n);
-
-    // Decrypt the encrypted key 
-    const cipherArray = encryptedKey.split(",").map(num => BigInt(num));
-    const decryptedKey = cipherArray.map(c => modPow(c, d, n)).map(c => String.fromCharCode(Number(c)));
-
-    // join the decrypted characters and return the Caesar key
-    return decryptedKey.join('');
-}
-
-
-function modPow(base, exp, mod) {
-    base %= mod;
-    let result = 1n;
-    while (exp > 0n) {
-        if (exp % 2n === 1n) result = (result * base) % mod;
-        base = (base * base) % mod;
-        exp >>= 1n;
-    }
-    return result;
+    // Decrypt the encrypted key, using CRT when the key has the parameters for it
+    return rsaDecrypt(encryptedKey, parsePrivateKey(privateKey));
 }
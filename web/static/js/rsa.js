@@ -0,0 +1,83 @@
+// Shared RSA helpers used to unlock the Caesar keys handed out by the KDC
+
+// Compute (base ^ exp) % mod
+function modPow(base, exp, mod) {
+    base %= mod;
+    let result = 1n;
+    while (exp > 0n) {
+        if (exp % 2n === 1n) result = (result * base) % mod;
+        base = (base * base) % mod;
+        exp >>= 1n;
+    }
+    return result;
+}
+
+// Convert the stored private key to BigInts.
+// Older keys only have d and n, newer ones also carry the CRT parameters.
+function parsePrivateKey(privateKey) {
+    const key = { d: BigInt(privateKey.d), n: BigInt(privateKey.n) };
+    if (privateKey.p && privateKey.q && privateKey.dp && privateKey.dq && privateKey.qinv) {
+        key.crt = {
+            p: BigInt(privateKey.p),
+            q: BigInt(privateKey.q),
+            dp: BigInt(privateKey.dp),
+            dq: BigInt(privateKey.dq),
+            qinv: BigInt(privateKey.qinv)
+        };
+    }
+    return key;
+}
+
+// Decrypt one number. With CRT we do two half-size exponentiations
+// and recombine them, which is several times faster than c^d mod n.
+function rsaDecryptNumber(c, key) {
+    if (!key.crt) return modPow(c, key.d, key.n);
+
+    const { p, q, dp, dq, qinv } = key.crt;
+    const m1 = modPow(c, dp, p);
+    const m2 = modPow(c, dq, q);
+    const h = (((qinv * (m1 - m2)) % p) + p) % p;
+    return m2 + h * q;
+}
+
+// Ciphertexts starting with this tag are packed: padded modulus-sized blocks,
+// base64 encoded. Anything else is the legacy one-number-per-character list.
+const PACKED_PREFIX = "rsa2:";
+
+// Decrypt a ciphertext from the KDC back into text
+function rsaDecrypt(ciphertext, key) {
+    if (ciphertext.startsWith(PACKED_PREFIX)) {
+        return rsaDecryptPacked(ciphertext.slice(PACKED_PREFIX.length), key);
+    }
+
+    return ciphertext.split(",")
+        .map(num => rsaDecryptNumber(BigInt(num), key))
+        .map(c => String.fromCharCode(Number(c)))
+        .join('');
+}
+
+// Decrypt each k-byte block, strip its 0x00 0x02 <random> 0x00 padding
+// and decode the concatenated message bytes as UTF-8
+function rsaDecryptPacked(payload, key) {
+    const k = Math.ceil(key.n.toString(16).length / 2);
+    const raw = Uint8Array.from(atob(payload), c => c.charCodeAt(0));
+    if (!raw.length || raw.length % k) throw new Error("Packed ciphertext length does not match the key size");
+
+    const data = [];
+    for (let i = 0; i < raw.length; i += k) {
+        const c = BigInt("0x" + toHex(raw.subarray(i, i + k)));
+        const block = fromHex(rsaDecryptNumber(c, key).toString(16).padStart(k * 2, "0"));
+        const separator = block.indexOf(0, 2);
+        if (block[0] !== 0 || block[1] !== 2 || separator < 10) throw new Error("Invalid padding in packed ciphertext");
+        data.push(...block.subarray(separator + 1));
+    }
+    return new TextDecoder().decode(new Uint8Array(data));
+}
+
+function toHex(bytes) {
+    return Array.from(bytes, b => b.toString(16).padStart(2, "0")).join("");
+}
+
+function fromHex(hex) {
+    return Uint8Array.from(hex.match(/../g), h => parseInt(h, 16));
+}
@@ -95,10 +95,19 @@ function generateRSAKeyPair() {
     // Compute private exponent d such that (d * e) % phi === 1
     d = modInverse(e, phi);
 
+    // CRT parameters, they make decryption several times faster
+    const dp = d % (p - 1n);
+    const dq = d % (q - 1n);
+    const qinv = modInverse(q, p);
+
     // Return keys as strings for compatibility
     return {
         publicKey: { e: e.toString(), n: n.toString() },     // Used for encryption and verification
-        privateKey: { d: d.toString(), n: n.toString() }     // Used for decryption and signing
+        privateKey: {                                        // Used for decryption and signing
+            d: d.toString(), n: n.toString(),
+            p: p.toString(), q: q.toString(),
+            dp: dp.toString(), dq: dq.toString(), qinv: qinv.toString()
+        }
     };
 }
 
@@ -0,0 +1,48 @@
+import json
+
+# orjson is optional: several times faster than the standard library for the
+# many small row fragments written here, but not required
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj) -> str:
+    """Encode `obj` as compact JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def loads(text):
+    """Decode one JSON document, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def stream_json_list(key, items, trailer=None, chunk_size=64 * 1024):
+    """
+    Generate a JSON object `{"<key>": [...items], ...trailer()}` piece by piece.
+
+    Items are encoded one at a time and written out in chunks of about
+    `chunk_size` characters, so memory stays flat however many items there are.
+    `trailer`, if given, is called once all items were consumed and returns the
+    extra fields of the object, e.g. a cursor that depends on the last item.
+    """
+    buffer = ['{', dumps(key), ':[']
+    size = 0
+    for i, item in enumerate(items):
+        fragment = dumps(item)
+        buffer.append(fragment if i == 0 else "," + fragment)
+        size += len(fragment) + 1
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer, size = [], 0
+
+    buffer.append("]")
+    for name, value in (trailer() if trailer else {}).items():
+        buffer.append("," + dumps(name) + ":" + dumps(value))
+    buffer.append("}")
+    yield "".join(buffer)
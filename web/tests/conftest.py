@@ -0,0 +1,86 @@
+"""
+Tests run against the database in DATABASE_URL, so the dialect-specific code
+paths (ON CONFLICT upserts, row-value comparisons, sequence handling) can be
+checked on each supported database:
+
+    python -m pytest tests                                                 # SQLite
+    DATABASE_URL=postgresql://localhost/keyforge_test python -m pytest tests
+
+Without DATABASE_URL a throwaway SQLite file is used. The tables of the
+configured database are dropped and recreated for every test, so point it at
+a database that holds nothing you want to keep.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+WORKDIR = tempfile.mkdtemp(prefix="keyforge-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(WORKDIR, 'test.sqlite3')}")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ["BCRYPT_LOG_ROUNDS"] = "4"
+os.environ["INGEST_MODE"] = "sync"
+os.environ["ARCHIVE_DIR"] = os.path.join(WORKDIR, "archive")
+
+from sqlalchemy import event
+
+from app import app as flask_app, db, User
+
+
+@pytest.fixture
+def app():
+    flask_app.config["TESTING"] = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def dialect(app):
+    with app.app_context():
+        return db.engine.dialect.name
+
+
+@pytest.fixture
+def login(app):
+    """Register `username` and return (logged in test client, user_id)."""
+    def login(username):
+        client = app.test_client()
+        client.post("/register", json=dict(username=username, email=f"{username}@test",
+                                           password="pw", password_confirm="pw"))
+        response = client.post("/login", json=dict(email=f"{username}@test", password="pw"))
+        assert response.status_code == 200, response.data
+        with app.app_context():
+            return client, User.query.filter_by(username=username).one().user_id
+    return login
+
+
+class QueryCounter:
+    """Counts the SQL statements executed while it is active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+@pytest.fixture
+def count_queries(app):
+    with app.app_context():
+        engine = db.engine
+    return lambda: QueryCounter(engine)
@@ -0,0 +1,193 @@
+"""
+Code paths that differ between SQLite and PostgreSQL. Run this module with
+DATABASE_URL pointing at each database (see conftest.py).
+"""
+import datetime
+import threading
+import time
+
+import pytest
+from sqlalchemy import event, func, select, text
+
+from app import (
+    db, User, Message, Conversation, EncryptedKeys,
+    claim_conversations, conversation_key, encrypted_keys_row, store_messages,
+    update_conversations, upsert_encrypted_keys,
+)
+
+
+def add_user(username):
+    user = User(user_id=f"id-{username}", username=username, email=f"{username}@test", password="x")
+    db.session.add(user)
+    db.session.flush()
+    return user.user_id
+
+
+def test_engine_is_configured_for_the_dialect(app, dialect):
+    with app.app_context():
+        if dialect == "sqlite":
+            assert db.session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert db.session.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        else:
+            assert db.engine.pool.size() == app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"]
+
+
+def test_upsert_replaces_the_keys_of_an_existing_pair(app):
+    with app.app_context():
+        alice, bob = add_user("alice"), add_user("bob")
+        upsert_encrypted_keys([encrypted_keys_row(alice, bob, "a1", "b1")])
+        db.session.commit()
+        # Same pair from the other side: must update the stored row, not add one
+        upsert_encrypted_keys([encrypted_keys_row(bob, alice, "b2", "a2")])
+        db.session.commit()
+
+        rows = EncryptedKeys.query.all()
+        assert len(rows) == 1
+        assert (rows[0].user1_id, rows[0].encrypted_key_1, rows[0].encrypted_key_2) == (alice, "a2", "b2")
+
+
+def test_storing_messages_upserts_the_conversation(app):
+    with app.app_context():
+        alice, bob = add_user("alice"), add_user("bob")
+        db.session.commit()
+        now = datetime.datetime.now()
+
+        def record(sender, receiver, text):
+            return dict(sender_id=sender, receiver_id=receiver, encrypted_message=text, timestamp=now.isoformat())
+
+        store_messages([record(alice, bob, "1"), record(alice, bob, "2")])
+        store_messages([record(bob, alice, "3")])
+
+        conversation = db.session.get(Conversation, conversation_key(alice, bob))
+        newest = db.session.execute(select(func.max(Message.id))).scalar()
+        assert conversation.last_message_id == newest
+        # alice sorts first: unread_1 is alice's, unread_2 is bob's
+        assert (conversation.unread_1, conversation.unread_2) == (1, 2)
+
+
+def test_user_directory_pages_with_a_row_value_cursor(app, login):
+    client, _ = login("viewer")
+    names = ["abc", "ABC", "Abc", "abd", "b", "B", "c"]
+    with app.app_context():
+        for name in names:
+            add_user(name)
+        db.session.commit()
+
+    seen, after = [], None
+    while True:
+        query = {"limit": 2, **({"after": after} if after else {})}
+        page = client.get("/api/users", query_string=query).get_json()
+        seen += [user["username"] for user in page["users"]]
+        after = page["next"]
+        if after is None:
+            break
+
+    # Ordered by (lower(username), username); names equal but for case must not be skipped
+    assert sorted(seen) == sorted(names)
+    assert [name.lower() for name in seen] == sorted(name.lower() for name in names)
+
+
+def test_import_continues_ids_after_the_imported_rows(app, tmp_path):
+    with app.app_context():
+        alice, bob = add_user("alice"), add_user("bob")
+        upsert_encrypted_keys([encrypted_keys_row(alice, bob, "a", "b")])
+        db.session.commit()
+        now = datetime.datetime.now().isoformat()
+        store_messages([dict(sender_id=alice, receiver_id=bob, encrypted_message=str(i), timestamp=now) for i in range(5)])
+        last_id = db.session.execute(select(func.max(Message.id))).scalar()
+
+    dump = str(tmp_path / "export.ndjson.gz")
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["keyforge", "export", dump])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+    result = runner.invoke(args=["keyforge", "import", dump])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        assert Message.query.count() == 5
+        assert EncryptedKeys.query.count() == 1
+        # New rows must not collide with imported ids (PostgreSQL sequences are reset by the import)
+        store_messages([dict(sender_id=bob, receiver_id=alice, encrypted_message="new", timestamp=now)])
+        assert db.session.execute(select(func.max(Message.id))).scalar() > last_id
+        db.session.add(User(user_id="id-carol", username="carol", email="carol@test", password="x"))
+        db.session.commit()
+
+
+def test_user_directory_cursor_seeks_the_index(app, login, dialect):
+    if dialect != "sqlite":
+        pytest.skip("checks the SQLite query plan")
+    client, _ = login("viewer")
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "ORDER BY lower(users.username)" in statement:
+            statements.append((statement, parameters))
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            assert client.get("/api/users", query_string={"after": "m"}).status_code == 200
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+
+        (statement, parameters), = statements
+        plan = db.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        assert any("SEARCH users USING" in row[-1] for row in plan), plan
+
+
+def test_user_directory_prefix_may_end_in_the_last_code_point(app, login):
+    client, _ = login("viewer")
+    with app.app_context():
+        add_user("a\U0010ffffb")
+        db.session.commit()
+
+    for q in ("\U0010ffff", "a\U0010ffff"):
+        response = client.get("/api/users", query_string={"q": q})
+        assert response.status_code == 200
+    assert [user["username"] for user in response.get_json()["users"]] == ["a\U0010ffffb"]
+
+
+def test_messages_of_a_conversation_commit_in_id_order(app):
+    with app.app_context():
+        alice, bob = add_user("alice"), add_user("bob")
+        db.session.commit()
+    now = datetime.datetime.now().isoformat()
+    with app.app_context():
+        # An existing conversation, so the second sender waits on its row lock
+        store_messages([dict(sender_id=alice, receiver_id=bob, encrypted_message="hello", timestamp=now)])
+    claimed = threading.Event()
+    ids = {}
+
+    def slow_sender():
+        # store_messages, pausing after the conversation was claimed
+        with app.app_context():
+            message = Message(conversation_id=conversation_key(alice, bob), sender_id=alice, receiver_id=bob,
+                              encrypted_message="first", timestamp=datetime.datetime.fromisoformat(now))
+            claim_conversations([message])
+            claimed.set()
+            time.sleep(0.5)
+            db.session.add(message)
+            db.session.flush()
+            update_conversations([message])
+            db.session.commit()
+            ids["first"] = message.id
+
+    thread = threading.Thread(target=slow_sender)
+    thread.start()
+    assert claimed.wait(5)
+    with app.app_context():
+        # Must wait for the first sender's commit, then draw a higher id
+        message, = store_messages([dict(sender_id=bob, receiver_id=alice, encrypted_message="second", timestamp=now)])
+        ids["second"] = message.id
+    thread.join()
+
+    assert ids["first"] < ids["second"]
+    with app.app_context():
+        conversation = db.session.get(Conversation, conversation_key(alice, bob))
+        assert conversation.last_message_id == ids["second"]
+        assert (conversation.unread_1, conversation.unread_2) == (1, 2)
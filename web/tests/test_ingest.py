@@ -0,0 +1,62 @@
+import json
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from ingest import IngestQueue, JournalInUse
+
+
+def make_queue(tmp_path, persist, **kwargs):
+    return IngestQueue(str(tmp_path / "ingest.journal"), persist, batch_size=10, retry_seconds=0.001,
+                       permanent_errors=(IntegrityError,), **kwargs).start()
+
+
+def test_outages_are_retried_without_dropping_messages(tmp_path):
+    stored, failures = [], [5]
+
+    def persist(records, recovering=False):
+        if failures[0]:
+            failures[0] -= 1
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        stored.extend(record["n"] for record in records)
+
+    queue = make_queue(tmp_path, persist, max_retry_seconds=0.002)
+    for n in range(25):
+        queue.submit({"n": n})
+    queue.flush()
+    queue.close()
+
+    assert stored == list(range(25))
+    assert queue.stats()["persisted"] == 25
+    assert queue.stats()["dead_lettered"] == 0
+    assert not (tmp_path / "ingest.journal.dead").exists()
+
+
+def test_rejected_messages_are_dead_lettered_and_the_rest_stored(tmp_path):
+    stored = []
+
+    def persist(records, recovering=False):
+        if any(record["n"] == 7 for record in records):
+            raise IntegrityError("INSERT", {}, Exception("foreign key constraint failed"))
+        stored.extend(record["n"] for record in records)
+
+    queue = make_queue(tmp_path, persist)
+    for n in range(25):
+        queue.submit({"n": n})
+    queue.flush()
+    queue.close()
+
+    assert stored == [n for n in range(25) if n != 7]
+    assert queue.stats()["persisted"] == 24
+    assert queue.stats()["dead_lettered"] == 1
+    dead = [json.loads(line) for line in (tmp_path / "ingest.journal.dead").read_text().splitlines()]
+    assert [record["n"] for record in dead] == [7]
+
+
+def test_a_journal_cannot_be_shared_between_processes(tmp_path):
+    first = make_queue(tmp_path, lambda records, recovering=False: None)
+    with pytest.raises(JournalInUse, match="INGEST_JOURNAL_PATH"):
+        make_queue(tmp_path, lambda records, recovering=False: None)
+
+    first.close()
+    make_queue(tmp_path, lambda records, recovering=False: None).close()
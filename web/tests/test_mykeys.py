@@ -0,0 +1,45 @@
+import uuid
+
+from app import db, User, encrypted_keys_row, upsert_encrypted_keys
+
+
+def add_contacts(app, user_id, count):
+    with app.app_context():
+        peers = []
+        for _ in range(count):
+            peer_id = str(uuid.uuid4())
+            db.session.add(User(user_id=peer_id, username=f"peer-{peer_id}", email=f"{peer_id}@test", password="x"))
+            peers.append(peer_id)
+        db.session.flush()
+        upsert_encrypted_keys([encrypted_keys_row(user_id, peer_id, f"mine-{peer_id}", "theirs") for peer_id in peers])
+        db.session.commit()
+    return peers
+
+
+def test_mykeys_returns_our_half_of_every_key(app, login):
+    client, user_id = login("alice")
+    peers = add_contacts(app, user_id, 5)
+
+    response = client.post("/mykeys")
+
+    assert response.status_code == 200
+    keys = {key["user_id"]: key for key in response.get_json()["keys"]}
+    assert set(keys) == set(peers)
+    for peer_id in peers:
+        assert keys[peer_id]["encrypted_key"] == f"mine-{peer_id}"
+        assert keys[peer_id]["username"] == f"peer-{peer_id}"
+
+
+def test_mykeys_query_count_does_not_grow_with_contacts(app, login, count_queries):
+    client, user_id = login("alice")
+    client.post("/mykeys")  # Warm the user cache, which is not what is measured here
+    counts, total = [], 0
+    for contacts in (1, 10, 50):
+        add_contacts(app, user_id, contacts - total)
+        total = contacts
+        with count_queries() as counter:
+            response = client.post("/mykeys")
+        assert response.status_code == 200
+        counts.append(counter.count)
+
+    assert counts[0] == counts[1] == counts[2], counts
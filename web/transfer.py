@@ -0,0 +1,182 @@
+import datetime
+import gzip
+import json
+import os
+
+from sqlalchemy import DateTime, select
+
+from streaming import dumps, loads
+
+FORMAT = "keyforge-export"
+VERSION = 1
+
+
+def open_dump(path, mode, compress=None, compresslevel=6):
+    """
+    Open an export file for reading ("r") or writing ("w") as text.
+    Files are gzip-compressed when `compress` is set or, by default, when the
+    name ends in .gz; when reading, compression is detected from the content.
+    """
+    if mode == "r":
+        with open(path, "rb") as f:
+            compressed = f.read(2) == b"\x1f\x8b"
+        if compressed:
+            return gzip.open(path, "rt", encoding="utf-8")
+        return open(path, "r", encoding="utf-8")
+
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", compresslevel=compresslevel)
+    return open(path, "w", encoding="utf-8")
+
+
+def _datetime_columns(table):
+    return [column.name for column in table.columns if isinstance(column.type, DateTime)]
+
+
+def export_tables(connection, tables, out, header=None, batch_size=10000, progress=None):
+    """
+    Write every row of `tables` to `out` as newline-delimited JSON: a header
+    line, then one `{"table": ..., "row": {...}}` line per row, table after
+    table in the given order and each ordered by primary key.
+    Rows are fetched from a server-side cursor `batch_size` at a time and
+    written as they arrive, so memory use does not grow with the database.
+    `progress(table_name, rows_so_far)` is called after every batch.
+    Returns:
+        dict: Rows written per table.
+    """
+    out.write(dumps({"format": FORMAT, "version": VERSION, **(header or {})}) + "\n")
+
+    counts = {}
+    for table in tables:
+        names = [column.name for column in table.columns]
+        datetimes = [names.index(name) for name in _datetime_columns(table)]
+        prefix = '{"table":' + dumps(table.name) + ',"row":'
+        result = connection.execution_options(yield_per=batch_size).execute(
+            select(table).order_by(*table.primary_key.columns)
+        )
+
+        count = 0
+        for rows in result.partitions():
+            lines = []
+            for row in rows:
+                # Plain tuples: mapping rows cost more than the encoding itself
+                values = list(row)
+                for i in datetimes:
+                    if values[i] is not None:
+                        values[i] = values[i].isoformat()
+                lines.append(prefix + dumps(dict(zip(names, values))) + "}\n")
+            out.write("".join(lines))
+            count += len(rows)
+            if progress:
+                progress(table.name, count)
+        result.close()
+        counts[table.name] = count
+
+    return counts
+
+
+def read_header(lines):
+    """Read and check the header line of an export."""
+    try:
+        header = loads(next(lines))
+    except (StopIteration, ValueError):
+        header = None
+    if not isinstance(header, dict) or header.get("format") != FORMAT:
+        raise ValueError("Not a KeyForge export file")
+    if header.get("version") != VERSION:
+        raise ValueError(f"Unsupported export version {header.get('version')}")
+    return header
+
+
+class ImportCheckpoint:
+    """
+    How many records of an export file were imported so far, kept in a small
+    JSON file so an interrupted import can pick up where it stopped. The size
+    of the export file is recorded alongside, so the checkpoint of one file is
+    never applied to another.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source_size = os.path.getsize(source)
+
+    def load(self) -> int:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return 0
+        if state.get("source_size") != self.source_size:
+            raise ValueError(f"Checkpoint {self.path} belongs to a different export file")
+        return state["records"]
+
+    def save(self, records):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source_size": self.source_size, "records": records}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def import_records(engine, tables, lines, insert, checkpoint, batch_size=5000, progress=None):
+    """
+    Insert the records read from `lines` (an export, header already consumed)
+    into `tables` (table name -> Table).
+    Consecutive records of one table are inserted `batch_size` at a time with
+    one multi-row INSERT per batch, each in its own transaction. After every
+    batch the checkpoint is saved; records it already covers are skipped. The
+    INSERT built by `insert(table)` ignores rows that already exist, so the
+    batch that was committed just before a crash, but not checkpointed, is
+    harmlessly replayed on resume.
+    `progress(table_name, rows_so_far)` is called after every batch.
+    Returns:
+        dict: Rows inserted (or replayed) per table by this run.
+    """
+    skip = checkpoint.load()
+    counts = {}
+    datetimes = {name: _datetime_columns(table) for name, table in tables.items()}
+
+    batch_table, batch, position = None, [], 0
+
+    def flush():
+        with engine.begin() as connection:
+            connection.execute(insert(tables[batch_table]).on_conflict_do_nothing(), batch)
+        checkpoint.save(position)
+        counts[batch_table] = counts.get(batch_table, 0) + len(batch)
+        if progress:
+            progress(batch_table, counts[batch_table])
+
+    for number, line in enumerate(lines, start=1):
+        if number <= skip or not line.strip():
+            continue
+
+        record = loads(line)
+        name = record["table"]
+        if name not in tables:
+            raise ValueError(f"Unknown table {name!r} on line {number + 1}")
+        if batch and name != batch_table:
+            flush()
+            batch = []
+
+        row = record["row"]
+        for column in datetimes[name]:
+            if row.get(column) is not None:
+                row[column] = datetime.datetime.fromisoformat(row[column])
+        batch_table = name
+        batch.append(row)
+        position = number
+
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+
+    if batch:
+        flush()
+    return counts